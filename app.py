@@ -3,37 +3,76 @@ import streamlit as st
 import os
 import numpy as np
 import pandas as pd
-import plotly.express as px
-
-from src.constants import DATA_DIR, map_fluorescence, fluorescence, ranking
-from src.fetch_data import update_data
-from src.inference import predict
-from src.paginator import paginator
-
-@st.cache
-def load_data(data_path):
-    file_path, download_status = update_data(data_path)
-    df = pd.read_csv(file_path)
-    df.drop(columns=['dateSet', 'strikethroughPrice', 'skus', 'v360BaseUrl',
-                     'shapeCode', 'imageUrl', 'detailsPageUrl'], inplace=True)
-    df.drop_duplicates(inplace=True)
-    # keep only diamonds with images
-    df.dropna(subset=['visualizationImageUrl'], inplace=True)
-    # reduce fluorescence options
-    df['fluorescence'] = df['fluorescence'].map(map_fluorescence)
-    # predict diamonds price using trained model
-    df['predicted_price'] = predict(df).astype(int)
-    # compute difference and sort in descending order by (predicted_price - actual_price)
-    df['estimate_difference'] = df['predicted_price'] - df['price']
-    df.sort_values(by=['estimate_difference'], ascending=False, inplace=True)
-    return df, download_status
-with st.spinner('Retreiving the latest data file...'):
-    data, resp = load_data(DATA_DIR)
-st.info(resp)
+
+from src.constants import DATA_DIR, SHAPES, SHAPE_NAMES, fluorescence, ranking
+from src.paginator import select_page
+from src.query import QueryEngine
+from src.render import render_cards, render_annotations
+from src.charts import build_scatter
+from src.refresh import SCORED_COLS, read_marker, start_background_refresh
+from src.shared import attach_catalogue
+from src.cache import catalogue_cache
+from src.estimator import make_diamond, estimate
+from src.neighbors import build_index
+from src.registry import registry_for
+from src import instrument
+from src.instrument import stage
+
+SORTCOL_MAP = {
+    'Actual Price': 'price',
+    'Carat': 'carat',
+    'Estimated Difference': 'estimate_difference',
+    'Predicted Price': 'predicted_price'
+}
+# above this many diamonds the scatterplot switches to binned mode
+CHART_POINT_BUDGET = 5000
+TOP_DEALS = 50
+
+# cached by key in a module that outlives reruns, nothing is hashed or copied
+# per interaction, the catalogue and its indexes are read-only
+def load_data(snapshot_path, shape=None):
+    # the snapshot is already cleaned, scored and sorted by the background refresh,
+    # all processes map the same shared copy and strings are decoded per page
+    catalogue = attach_catalogue(snapshot_path, columns=SCORED_COLS)
+    # index the catalogue once, the sidebar queries below reuse it on every rerun;
+    # the indexes are built in each process, only the columns are shared
+    engine = QueryEngine(catalogue.frame, sort_cols=list(SORTCOL_MAP.values()),
+                         strings=catalogue.strings)
+    # comparable diamonds in the model feature space, queried for each page of cards
+    comparables = build_index(catalogue.frame, registry_for(shape).get()[1], catalogue.strings)
+    return catalogue, engine, comparables
+
+instrument.start_run()
+# crawling and scoring happen in the background, never inside a user request
+start_background_refresh(DATA_DIR, shapes=SHAPES)
+marker = read_marker(DATA_DIR)
+if marker is None:
+    st.info('The diamonds catalogue is being prepared for the first time, please check back in a few minutes.')
+    st.stop()
+# a multi-shape catalogue has one scored snapshot per shape, only the selected one is loaded
+shape = None
+entry = marker
+if marker.get('shapes'):
+    shape = st.sidebar.selectbox(label='Shape', options=list(marker['shapes']),
+                                 format_func=lambda code: SHAPE_NAMES.get(code, code))
+    entry = marker['shapes'][shape]
+with stage('load_data'):
+    catalogue, engine, comparables = catalogue_cache.get(
+        (entry['path'], entry.get('model_version')), lambda: load_data(entry['path'], shape))
+st.info(marker['status'])
+
+# the round diamonds catalogue covers $10K-$30K, other shapes use the range crawled
+if shape is None:
+    price_range = (1e4, 3e4)
+elif len(catalogue.frame):
+    price_range = (float(catalogue.frame['price'].min()), float(catalogue.frame['price'].max()))
+else:
+    price_range = (0., 0.)
 
 # HEADER
 st.title('💎Simple Diamond Selector💎')
-st.write('Welcome :wave: Currently we only consider **Round** diamonds with price between *$10K* and *$30K*. The latest model was trained without limiting price range, and has a mean absolute error of *$572* on test set. The model shows the biggest errors around borders of the price range.')
+st.write('Welcome :wave: Currently we only consider **{}** diamonds with price between *${:,.0f}* and *${:,.0f}*. The latest model was trained without limiting price range, and has a mean absolute error of *$572* on test set. The model shows the biggest errors around borders of the price range.'.format(
+    SHAPE_NAMES.get(shape or 'RD', shape), *price_range))
 st.write('*Please also note:* we found the model predicts very high price on some diamonds while actual price is low, due to additional assessments provided by the GIA reports.')
 st.write('---')
 
@@ -47,10 +86,16 @@ carat_filter = st.sidebar.slider(
     label='Carat',
     min_value=1.0, max_value=4.0, value=(1.5, 3.0), step=0.01, format='%f'
 )
-price_filter = st.sidebar.slider(
-    label='Price',
-    min_value=1e4, max_value=3e4, value=(12000.0, 25000.0), step=100., format='%f'
-)
+if price_range[0] < price_range[1]:
+    price_filter = st.sidebar.slider(
+        label='Price',
+        min_value=price_range[0], max_value=price_range[1],
+        value=(12000.0, 25000.0) if shape is None else price_range, step=100., format='%f'
+    )
+else:
+    # every diamond of the shape has the same price, nothing to slide over
+    price_filter = price_range
+    st.sidebar.write('Price: ${:,.0f}'.format(price_range[0]))
 color_filter = st.sidebar.multiselect(
     label='Color',
     options=ranking['color'],
@@ -70,71 +115,70 @@ sort_image_by = st.sidebar.selectbox(
     label='Sort diamonds by (descending)',
     options=('Estimated Difference', 'Predicted Price', 'Actual Price', 'Carat')
 )
-SORTCOL_MAP = {
-    'Actual Price': 'price',
-    'Carat': 'carat',
-    'Estimated Difference': 'estimate_difference',
-    'Predicted Price': 'predicted_price'
-}
 
-filtered_data = data[
-    (data['carat'] >= carat_filter[0]) & (data['carat'] <= carat_filter[1]) &
-    (data['price'] >= price_filter[0]) & (data['price'] <= price_filter[1]) &
-    (data['color'].isin(color_filter)) &
-    (data['clarity'].isin(clarity_filter)) &
-    (data['fluorescence'].isin(fluorescence_filter))
-].sort_values(by=SORTCOL_MAP[sort_image_by], ascending=False)
-
-HOVER_DATA = ['cut', 'fluorescence', 'polish', 'symmetry', 'table', 'predicted_price']  
+with stage('filter'):
+    selection = engine.select(
+        ranges={'carat': carat_filter, 'price': price_filter},
+        isin={'color': color_filter, 'clarity': clarity_filter, 'fluorescence': fluorescence_filter}
+    )
 
 # MAIN CANVAS
-st.write("Number of diamonds in selection: ", filtered_data.shape[0])
-
-# Settings
-MAIN_COLS = ['carat', 'price', 'id', 'predicted_price', 
-             'estimate_difference', 'visualizationImageUrl']
-ATTR_COLS = ['color', 'clarity', 'cut', 'fluorescence']
-DETAILS_URL = 'https://www.bluenile.com/diamond-details/{}'
-
-
-def extract_row(row):
-    x, y, id, pp, ed, image = row[MAIN_COLS].values
-    color, clarity, cut, fluorescence = row[ATTR_COLS].values
-    url = DETAILS_URL.format(id)
-    return (x, y, id, pp, ed, image, 
-        color, clarity, cut, fluorescence, url)
+st.write("Number of diamonds in selection: ", len(selection))
 
 # Show list of diamonds
-n = filtered_data.shape[0]
-for i, row in paginator("Select a page", list(range(n)), items_per_page=5, on_sidebar=False):
-    row = filtered_data.iloc[i]
-    x, y, id, pp, ed, image, color, clarity, cut, fluorescence, url = extract_row(row)
-    # show list of diamonds
-    st.write(
-        '[![image]({})]({})'.format(image, url),
-        'Carat: {}, Price: ${}; Suggested: ${}'.format(x, y, pp),
-        '  \nID: [{}]({}) Color **{}**, Clarity **{}**, Cut **{}**, Fluorescence **{}**'.format(id, url, color, clarity, cut, fluorescence))
-
-# Base chart
-fig = px.scatter(filtered_data, x='carat', y='price', 
-    symbol='clarity', color='color',
-    hover_name='id',
-    hover_data=HOVER_DATA
-)
-# Add annotation to top 5 suggested
-for i in range(5):
-    row = filtered_data.iloc[i]
-    x, y, id, pp, ed, image, color, clarity, cut, fluorescence, url = extract_row(row)
-    # add other attributes to the base chart
-    fig.add_annotation(
-        x=x, y=y, text="<a href='{}'>${}(+{})</a>".format(url, y, ed)
-    )
+# only the rows of the page shown are fetched, and written with one markdown call
+sort_col = SORTCOL_MAP[sort_image_by]
+start, stop = select_page("Select a page", len(selection), items_per_page=5, on_sidebar=False)
+with stage('render_cards', rows=stop - start):
+    page = selection.page(sort_col, start, stop)
+    st.markdown(render_cards(page, comparables.comparable_prices(page.index.values)))
+
+# Base chart, large selections are binned and only the best deals drawn as points
+# binned mode only reads carat, price and estimate_difference, skip decoding strings
+with stage('build_chart', rows=len(selection)):
+    fig = build_scatter(selection.frame(strings=len(selection) <= CHART_POINT_BUDGET),
+                        top=selection.page('estimate_difference', 0, TOP_DEALS),
+                        point_budget=CHART_POINT_BUDGET)
+    # Add annotation to top 5 suggested
+    fig.update_layout(annotations=render_annotations(selection.page(sort_col, 0, 5)))
 
 st.markdown('---')
 st.subheader('Diamonds on one Scatterplot')
 st.markdown("My wife really doesn't like this chart. She said it is confusing, and unless I explained to her what is going on, she could not understand anything here. I tried to convince her this is a good summary of the information, but fine, it's alright.")
-st.plotly_chart(fig, use_container_width=True)
+with stage('plotly_chart'):
+    st.plotly_chart(fig, use_container_width=True)
 
 if st.checkbox('Show raw data'):
     st.subheader('Raw data')
-    st.write(filtered_data)
\ No newline at end of file
+    st.write(selection.frame(sort_col))
+
+# WHAT-IF, price a hypothetical diamond with the same model
+st.markdown('---')
+st.subheader('What would my diamond cost?')
+with st.form('what_if'):
+    col1, col2, col3 = st.columns(3)
+    carat = col1.number_input('Carat', min_value=0.2, max_value=10., value=1.5, step=0.01)
+    color = col2.selectbox('Color', ranking['color'][::-1])
+    clarity = col3.selectbox('Clarity', ranking['clarity'][::-1])
+    cut = col1.selectbox('Cut', ranking['cut'][::-1])
+    polish = col2.selectbox('Polish', ranking['polish'][::-1])
+    symmetry = col3.selectbox('Symmetry', ranking['symmetry'][::-1])
+    what_if_fluorescence = col1.selectbox('Fluorescence', fluorescence[::-1])
+    depth = col2.number_input('Depth %', min_value=40., max_value=80., value=61.8, step=0.1)
+    table = col3.number_input('Table %', min_value=40., max_value=80., value=57., step=0.1)
+    length = col1.number_input('Length (mm)', min_value=1., max_value=20., value=7.3, step=0.01)
+    width = col2.number_input('Width (mm)', min_value=1., max_value=20., value=7.28, step=0.01)
+    height = col3.number_input('Height (mm)', min_value=1., max_value=20., value=4.5, step=0.01)
+    submitted = st.form_submit_button('Estimate')
+if submitted:
+    with stage('what_if'):
+        price = estimate(make_diamond(carat, color, clarity, cut, length, width, height,
+                                      polish=polish, symmetry=symmetry, depth=depth, table=table,
+                                      fluorescence=what_if_fluorescence), shape=shape)
+    st.success('Estimated price: ${:,.0f}'.format(price))
+
+# DEBUG, only with DIAMONDS_PROFILE set, see src.instrument
+if instrument.ENABLED:
+    with st.sidebar.expander('Profile of the last rerun'):
+        st.table(pd.DataFrame(instrument.last_run()))
+        st.write(catalogue_cache.stats())
@@ -0,0 +1,67 @@
+"""
+    Compare the original prepare_input with the fitted-once FeatureTransformer
+
+    python -m benchmarks.bench_features --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import PolynomialFeatures, OneHotEncoder
+
+from src.constants import MODEL_SCALER_PATH, map_fluorescence, ranking, fluorescence
+from src.features import FeatureTransformer, load_scaler
+from benchmarks.synthetic import make_catalogue
+
+
+def prepare_input_legacy(df):
+    """prepare_input as it was before src.features, kept as the reference output"""
+    measurements = df['measurements'].str.replace(' mm', '').str.split(' x ', expand=True)
+    measurements = measurements.apply(pd.to_numeric)
+    measurements.columns = ['length', 'width', 'height']
+    df = df.join(measurements)
+    for key, value in ranking.items():
+        value_map = {k: v for v, k in enumerate(value)}
+        df['ord_{}'.format(key)] = df[key].map(value_map)
+    enc = OneHotEncoder(categories=[fluorescence], sparse=False)
+    x_fluors = enc.fit_transform(df['fluorescence'].values.reshape(-1, 1))
+    x_visual = df['hasVisualization'].astype(int).values.reshape(-1, 1)
+    cols_num = ['carat', 'depth', 'lxwRatio', 'table', 'sellingIndex', 'length', 'width', 'height']
+    cols_ord = ['ord_{}'.format(key) for key in ranking.keys()]
+    poly_features = PolynomialFeatures(degree=2, include_bias=False)
+    x_poly = poly_features.fit_transform(df[cols_num + cols_ord].values)
+    scaler = load_scaler(MODEL_SCALER_PATH)
+    x_minmax = scaler.transform(x_poly)
+    x = np.hstack((x_minmax, x_fluors, x_visual))
+    return x.astype("float32")
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    transformer = FeatureTransformer(load_scaler(MODEL_SCALER_PATH))
+    for n in args.sizes:
+        df = make_catalogue(n)
+        df['fluorescence'] = df['fluorescence'].map(map_fluorescence)
+        legacy_time, legacy = best_of(lambda: prepare_input_legacy(df), args.repeat)
+        new_time, new = best_of(lambda: transformer.transform(df), args.repeat)
+        assert np.array_equal(legacy, new, equal_nan=True), 'outputs differ at n={}'.format(n)
+        print({'rows': n, 'legacy_s': round(legacy_time, 4), 'transformer_s': round(new_time, 4),
+               'speedup': round(legacy_time / new_time, 1)})
+
+
+if __name__ == '__main__':
+    main()
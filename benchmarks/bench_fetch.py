@@ -0,0 +1,49 @@
+"""
+    Compare sequential and parallel downloads against the local fake api
+
+    python -m benchmarks.bench_fetch --n 20000 --latency 0.2 --workers 4
+"""
+import argparse
+import time
+
+from src.fetch_data import Diamonds, required_params
+from benchmarks.fake_api import FakeBlueNile
+from benchmarks.synthetic import make_records
+
+
+def run(api, mode, **kwargs):
+    diamonds = Diamonds(home_url=api.home_url, api_url=api.api_url)
+    diamonds.addParams(required_params)
+    n_requests = api.n_requests
+    start = time.perf_counter()
+    if mode == 'sequential':
+        diamonds.download(delay=0)
+    else:
+        diamonds.download_parallel(**kwargs)
+    elapsed = time.perf_counter() - start
+    diamonds.clean()
+    ids = set(diamonds.df['id'])
+    return {'mode': mode, 'seconds': round(elapsed, 3), 'diamonds': len(ids),
+            'requests': api.n_requests - n_requests}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n', type=int, default=20000, help='number of fake diamonds')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per response')
+    parser.add_argument('--bands', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=None, help='max requests per second')
+    args = parser.parse_args()
+
+    records = make_records(args.n)
+    with FakeBlueNile(records, latency=args.latency) as api:
+        for result in [run(api, 'sequential'),
+                       run(api, 'parallel', n_bands=args.bands,
+                           max_workers=args.workers, rate_limit=args.rate)]:
+            assert result['diamonds'] == args.n, result
+            print(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+    Local stand-in for the BlueNile search api
+
+    Serves a fixed list of raw diamond records over http on localhost, with
+    the same paging semantics the crawler relies on (sorted by price, filtered
+    by minPrice/maxPrice, at most pageSize results plus countRaw). Use it to
+    run and benchmark the download modes without touching the real site.
+
+    >>> from src.fetch_data import Diamonds
+    >>> from benchmarks.synthetic import make_records
+    >>> with FakeBlueNile(make_records(5000), latency=0.05) as api:
+    ...     diamonds = Diamonds(home_url=api.home_url, api_url=api.api_url)
+"""
+import bisect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from src.fetch_data import _price_to_int, _unwrap
+
+API_PATH = '/api/public/diamond-search-grid/v2'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, so that clients reusing their connections can be told apart
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.api.lock:
+            self.server.api.n_connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if self.path == '/':
+            self.send_header('Set-Cookie', 'session=fake')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        api = self.server.api
+        url = urlparse(self.path)
+        with api.lock:
+            api.n_requests += 1
+            fail = api.fail_every and api.n_requests % api.fail_every == 0
+        if api.latency:
+            time.sleep(api.latency)
+        if url.path == '/':
+            return self._send(200, b'<html></html>', 'text/html')
+        if url.path != API_PATH:
+            return self._send(404, b'{}')
+        if fail:
+            return self._send(503, b'{}')
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        lo = bisect.bisect_left(api.prices, int(query.get('minPrice', 0)))
+        hi = bisect.bisect_right(api.prices, int(query.get('maxPrice', api.prices[-1])))
+        start = lo + int(query.get('startIndex', 0))
+        page = api.records[start:min(start + int(query.get('pageSize', 1000)), hi)]
+        body = json.dumps({'countRaw': hi - lo, 'results': page}).encode()
+        self._send(200, body)
+
+
+class FakeBlueNile:
+    """
+        records: (list) raw diamond dicts, e.g. from benchmarks.synthetic.make_records
+        latency: (float) seconds added to every response
+        fail_every: (int) answer every n-th request with a 503, 0 to never fail
+
+        n_requests and n_connections count what the server received.
+    """
+
+    def __init__(self, records, latency=0., fail_every=0):
+        self.records = sorted(records, key=lambda x: _price_to_int(_unwrap(x['price'])))
+        self.prices = [_price_to_int(_unwrap(x['price'])) for x in self.records]
+        self.latency = latency
+        self.fail_every = fail_every
+        self.n_requests = 0
+        self.n_connections = 0
+        self.lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def home_url(self):
+        return 'http://127.0.0.1:{}'.format(self._server.server_port)
+
+    @property
+    def api_url(self):
+        return self.home_url + API_PATH
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,287 @@
+"""
+    Benchmark suite: fetch, clean, featurize, predict, filter and render
+
+    python -m benchmarks.run --sizes 10000 100000 1000000 --output bench.json
+    python -m benchmarks.run --output new.json --baseline bench.json --tolerance 0.2
+
+    Every stage runs on synthetic diamonds at each size. Wall time is the
+    best of --repeat runs; peak memory is measured with tracemalloc on one
+    extra run, so tracing does not slow down the timed runs. Results are
+    written as json, and with --baseline the run exits with status 1 when a
+    stage got slower or bigger than the baseline by more than --tolerance.
+
+    Stages:
+        fetch: parallel crawl of the local fake api (normalizes pages too),
+               only up to --fetch-max rows since the server holds every record
+        clean: normalize raw api pages and put them together (Diamonds.clean)
+        featurize: FeatureTransformer.transform, the model input
+        predict: model forward pass, skipped if the model cannot be loaded
+        filter: index the catalogue, then run sidebar queries and fetch pages
+        render: diamond cards, annotations and the scatterplot payload
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from src.constants import MODEL_SCALER_PATH, map_fluorescence
+from src.features import FeatureTransformer, load_scaler
+from src.fetch_data import Diamonds, normalize_page, required_params
+from src.query import QueryEngine
+from src.render import render_cards, render_annotations
+from src.charts import build_scatter
+from benchmarks.fake_api import FakeBlueNile
+from benchmarks.synthetic import make_records
+
+STAGES = ['fetch', 'clean', 'featurize', 'predict', 'filter', 'render']
+SORT_COLS = ['price', 'carat', 'estimate_difference', 'predicted_price']
+PAGE_SIZE = 1000
+# differences below this many seconds are noise, never reported as regressions
+MIN_SECONDS = 0.005
+
+
+class Skip(Exception):
+    """Raised by a stage that cannot run in this environment."""
+
+
+class Timer:
+    """Accumulates the time spent inside `with timer:` blocks."""
+
+    def __init__(self):
+        self.seconds = 0.
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds += time.perf_counter() - self._start
+
+
+def raw_pages(n, page_size=PAGE_SIZE, seed=0):
+    """
+        Yield api result pages holding n diamonds in total
+
+        One page of records is generated and copied with new ids, building
+        a million raw records up front would not fit in memory.
+    """
+    template = make_records(min(n, page_size), seed)
+    for start in range(0, n, page_size):
+        stop = min(start + page_size, n)
+        yield [dict(record, id=['LD{:08d}'.format(i)])
+               for i, record in zip(range(start, stop), template)]
+
+
+def stage_fetch(ctx, timer):
+    if ctx['rows'] > ctx['fetch_max']:
+        raise Skip('above --fetch-max ({})'.format(ctx['fetch_max']))
+    if 'api_records' not in ctx:
+        ctx['api_records'] = make_records(ctx['rows'], ctx['seed'])
+    with FakeBlueNile(ctx['api_records']) as api:
+        diamonds = Diamonds(home_url=api.home_url, api_url=api.api_url)
+        diamonds.addParams(required_params)
+        with timer:
+            diamonds.download_parallel(n_bands=8, max_workers=4, rate_limit=None)
+            diamonds.clean()
+        n_requests = api.n_requests
+    assert len(diamonds.df) == ctx['rows'], 'fetched {} diamonds'.format(len(diamonds.df))
+    return {'requests': n_requests}
+
+
+def stage_clean(ctx, timer):
+    diamonds = Diamonds()
+    for records in raw_pages(ctx['rows'], seed=ctx['seed']):
+        with timer:
+            diamonds._add_page(normalize_page(records))
+    with timer:
+        diamonds.clean()
+    df = diamonds.df.dropna(subset=['visualizationImageUrl']).reset_index(drop=True)
+    df['fluorescence'] = df['fluorescence'].map(map_fluorescence)
+    ctx['catalogue'] = df
+    return {'diamonds': len(diamonds.df)}
+
+
+def stage_featurize(ctx, timer):
+    if 'transformer' not in ctx:
+        ctx['transformer'] = FeatureTransformer(load_scaler(MODEL_SCALER_PATH))
+    transformer = ctx['transformer']
+    with timer:
+        x = transformer.transform(ctx['catalogue'])
+    return {'features': x.shape[1]}
+
+
+def stage_predict(ctx, timer):
+    try:
+        from src.inference import predict
+        from src.registry import registry
+        registry.warm()
+    except ImportError as e:
+        raise Skip('model not available: {}'.format(e))
+    with timer:
+        ctx['predicted_price'] = predict(ctx['catalogue'], batch_size=4096).astype(int)
+    return {}
+
+
+def _scored(ctx):
+    """Catalogue with the prediction columns, synthetic ones if predict was skipped."""
+    if 'scored' not in ctx:
+        df = ctx['catalogue'].copy()
+        predicted = ctx.get('predicted_price')
+        if predicted is None:
+            rng = np.random.default_rng(ctx['seed'])
+            predicted = (df['price'].values * rng.uniform(0.8, 1.2, len(df))).astype(int)
+        df['predicted_price'] = predicted
+        df['estimate_difference'] = df['predicted_price'] - df['price']
+        ctx['scored'] = df.sort_values('estimate_difference', ascending=False, ignore_index=True)
+    return ctx['scored']
+
+
+def _queries(df):
+    """Sidebar states: the default one, then narrower and wider selections."""
+    colors = list(df['color'].cat.categories) if hasattr(df['color'], 'cat') \
+        else sorted(df['color'].unique())
+    return [
+        ({'carat': (1., 4.), 'price': (10000, 30000)}, {}),
+        ({'carat': (1.5, 2.), 'price': (10000, 20000)}, {'color': colors[:3]}),
+        ({'carat': (1., 1.2), 'price': (10000, 30000)}, {'clarity': ['VS1', 'VS2']}),
+    ]
+
+
+def stage_filter(ctx, timer):
+    df = _scored(ctx)
+    with timer:
+        engine = QueryEngine(df, sort_cols=SORT_COLS)
+        sizes = []
+        for ranges, isin in _queries(df):
+            selection = engine.select(ranges=ranges, isin=isin)
+            for sort_col in SORT_COLS:
+                selection.page(sort_col, 0, 10)
+            sizes.append(len(selection))
+    ctx['selection'] = engine.select(*_queries(df)[0])
+    return {'selected': sizes}
+
+
+def stage_render(ctx, timer):
+    selection = ctx.get('selection')
+    if selection is None:
+        raise Skip('needs the filter stage')
+    with timer:
+        cards = render_cards(selection.page('price', 0, 10))
+        fig = build_scatter(selection.frame(),
+                            top=selection.page('estimate_difference', 0, 50))
+        fig.update_layout(annotations=render_annotations(selection.page('price', 0, 5)))
+        payload = fig.to_json()
+    return {'cards_bytes': len(cards), 'chart_bytes': len(payload)}
+
+
+STAGE_FUNCTIONS = {
+    'fetch': stage_fetch,
+    'clean': stage_clean,
+    'featurize': stage_featurize,
+    'predict': stage_predict,
+    'filter': stage_filter,
+    'render': stage_render,
+}
+
+
+def measure(fn, ctx, repeat, memory=True):
+    """
+        Return: (dict) best seconds over repeat runs, peak traced MB and the stage info
+    """
+    times = []
+    for _ in range(repeat):
+        timer = Timer()
+        info = fn(ctx, timer)
+        times.append(timer.seconds)
+    result = {'seconds': round(min(times), 4)}
+    if memory:
+        tracemalloc.start()
+        try:
+            fn(ctx, Timer())
+            result['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        finally:
+            tracemalloc.stop()
+    result.update(info)
+    return result
+
+
+def run(sizes, stages=STAGES, repeat=3, fetch_max=100000, memory=True, seed=0, verbose=True):
+    """
+        Return: (list) one result dict per (stage, rows)
+    """
+    results = []
+    for n in sizes:
+        ctx = {'rows': n, 'seed': seed, 'fetch_max': fetch_max}
+        # clean always runs, later stages read its catalogue
+        for stage in STAGES:
+            if stage not in stages and stage != 'clean':
+                continue
+            try:
+                result = dict(stage=stage, rows=n, **measure(STAGE_FUNCTIONS[stage], ctx, repeat, memory))
+            except Skip as e:
+                result = {'stage': stage, 'rows': n, 'skipped': str(e)}
+            if stage in stages:
+                results.append(result)
+                if verbose:
+                    print(json.dumps(result))
+    return results
+
+
+def _environment():
+    return {'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'numpy': np.__version__, 'pandas': pd.__version__}
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+        Return: (list) messages for each stage slower or bigger than baseline by more than tolerance
+    """
+    base = {(r['stage'], r['rows']): r for r in baseline if 'skipped' not in r}
+    regressions = []
+    for r in results:
+        b = base.get((r['stage'], r['rows']))
+        if b is None or 'skipped' in r:
+            continue
+        if r['seconds'] > b['seconds'] * (1 + tolerance) and r['seconds'] - b['seconds'] > MIN_SECONDS:
+            regressions.append('{stage} @ {rows} rows: {0}s vs {1}s'.format(
+                r['seconds'], b['seconds'], **r))
+        if 'peak_mb' in r and 'peak_mb' in b and r['peak_mb'] > b['peak_mb'] * (1 + tolerance) + 1:
+            regressions.append('{stage} @ {rows} rows: peak {0}MB vs {1}MB'.format(
+                r['peak_mb'], b['peak_mb'], **r))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the pipeline stages on synthetic diamonds.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--fetch-max', type=int, default=100000, help='largest size crawled over http')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--output', help='json file to write the results to')
+    parser.add_argument('--baseline', help='json results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown, 0.2 = 20%%')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.stages, args.repeat, args.fetch_max, not args.no_memory)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': _environment(), 'results': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+        for message in regressions:
+            print('REGRESSION ' + message)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
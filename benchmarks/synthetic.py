@@ -0,0 +1,104 @@
+"""
+    Synthetic diamonds in the shape of the BlueNile search api
+
+    Values are random but respect the vocabularies in src.constants, so
+    they go through clean, prepare_input and the app filters unchanged.
+"""
+import numpy as np
+import pandas as pd
+from src.constants import ranking
+
+# raw fluorescence labels as returned by the api, before map_fluorescence
+RAW_FLUORESCENCE = ['None', 'Faint', 'Faint Blue', 'Medium Blue', 'Medium Yellow',
+                    'Strong Blue', 'Very Strong Blue']
+
+
+def _choice(rng, values, n):
+    return np.asarray(values, dtype=object)[rng.integers(0, len(values), n)]
+
+
+def make_columns(n, seed=0, min_price=10000, max_price=30000):
+    """
+        Return: (dict) column name -> numpy array of n clean values
+    """
+    rng = np.random.default_rng(seed)
+    carat = np.round(rng.uniform(1., 4., n), 2)
+    width = np.round(6.4 * np.cbrt(carat), 2)
+    return {
+        'id': np.array(['LD{:08d}'.format(i) for i in range(n)], dtype=object),
+        'carat': carat,
+        'price': rng.integers(min_price, max_price + 1, n),
+        'color': _choice(rng, ranking['color'], n),
+        'clarity': _choice(rng, ranking['clarity'], n),
+        'cut': _choice(rng, ranking['cut'], n),
+        'culet': _choice(rng, ranking['culet'], n),
+        'polish': _choice(rng, ranking['polish'], n),
+        'symmetry': _choice(rng, ranking['symmetry'], n),
+        'fluorescence': _choice(rng, RAW_FLUORESCENCE, n),
+        'depth': np.round(rng.uniform(58., 64., n), 1),
+        'table': np.round(rng.uniform(53., 62., n), 1),
+        'lxwRatio': np.round(rng.uniform(1., 1.03, n), 2),
+        'length': width,
+        'width': np.round(width * rng.uniform(0.98, 1., n), 2),
+        'height': np.round(width * 0.62, 2),
+        'sellingIndex': np.round(rng.uniform(0.5, 1., n), 3),
+        'hasVisualization': rng.random(n) < 0.9,
+    }
+
+
+def make_records(n, seed=0, min_price=10000, max_price=30000):
+    """
+        Return: (list) n raw diamond dicts, every value wrapped in a list like the api does
+    """
+    c = make_columns(n, seed, min_price, max_price)
+    records = []
+    for i in range(n):
+        diamond_id = c['id'][i]
+        price = int(c['price'][i])
+        image = ('https://example.com/{}.jpg'.format(diamond_id)
+                 if c['hasVisualization'][i] else None)
+        records.append({
+            'id': [diamond_id],
+            'carat': ['{:.2f}'.format(c['carat'][i])],
+            'price': ['${:,}'.format(price)],
+            'pricePerCarat': ['${:,}'.format(int(price / c['carat'][i]))],
+            'color': [c['color'][i]],
+            'clarity': [c['clarity'][i]],
+            'cut': [{'label': c['cut'][i]}],
+            'culet': [c['culet'][i]],
+            'polish': [c['polish'][i]],
+            'symmetry': [c['symmetry'][i]],
+            'fluorescence': [c['fluorescence'][i]],
+            'depth': ['{:.1f}'.format(c['depth'][i])],
+            'table': ['{:.1f}'.format(c['table'][i])],
+            'lxwRatio': ['{:.2f}'.format(c['lxwRatio'][i])],
+            'measurements': [{'label': '{:.2f} x {:.2f} x {:.2f} mm'.format(
+                c['length'][i], c['width'][i], c['height'][i])}],
+            'sellingIndex': [float(c['sellingIndex'][i])],
+            'hasVisualization': [bool(c['hasVisualization'][i])],
+            'visualizationImageUrl': [image],
+            # columns the app drops on load
+            'dateSet': ['2020-01-01'],
+            'strikethroughPrice': [None],
+            'skus': [[diamond_id]],
+            'v360BaseUrl': [None],
+            'shapeCode': ['RD'],
+            'imageUrl': [image],
+            'detailsPageUrl': ['./diamond-details/{}'.format(diamond_id)],
+        })
+    return records
+
+
+def make_catalogue(n, seed=0, min_price=10000, max_price=30000):
+    """
+        Return: pandas dataframe of n diamonds as Diamonds.clean leaves them
+    """
+    c = make_columns(n, seed, min_price, max_price)
+    length, width, height = [pd.Series(np.char.mod('%.2f', c.pop(col)), dtype=object)
+                             for col in ['length', 'width', 'height']]
+    df = pd.DataFrame(c)
+    df['measurements'] = length + ' x ' + width + ' x ' + height + ' mm'
+    df['pricePerCarat'] = (df['price'] / df['carat']).astype(int)
+    df['visualizationImageUrl'] = np.where(
+        df['hasVisualization'], 'https://example.com/' + df['id'] + '.jpg', None)
+    return df
@@ -0,0 +1,105 @@
+"""
+    Batch scoring and deal ranking without Streamlit
+
+    python -m src.batch --input data/diamonds_20200101.snap --output ranked.csv
+
+    The input is read in fixed-size chunks. Each chunk is scored, sorted by
+    estimate_difference and written to a temporary run file. The runs are
+    then merged into the ranked output one row at a time, so memory stays
+    at about one chunk whatever the size of the input.
+"""
+import os
+import csv
+import time
+import heapq
+import shutil
+import argparse
+import tempfile
+
+from .categories import normalize
+from .constants import DATA_DIR
+from .fetch_data import update_data
+from .inference import predict, drop_unpriced
+from .registry import registry
+from .snapshot import SNAPSHOT_COLS, iter_catalogue
+
+RANK_COL = 'estimate_difference'
+
+
+def score_chunk(df, batch_size=None):
+    """
+        Add predicted_price and estimate_difference to a chunk of the catalogue
+    """
+    # csv chunks hold raw strings, mapped once per distinct value
+    df = normalize(df.copy(), strict=['fluorescence'])
+    df['predicted_price'] = predict(df, batch_size=batch_size)
+    df = drop_unpriced(df)
+    df[RANK_COL] = df['predicted_price'] - df['price']
+    return df
+
+
+def _merge_runs(run_paths, output_path):
+    """Merge run files, each sorted by RANK_COL descending, into one ranked csv."""
+    files = [open(path, newline='') for path in run_paths]
+    try:
+        readers = [csv.reader(f) for f in files]
+        header = [next(reader) for reader in readers][0]
+        rank_idx = header.index(RANK_COL)
+        with open(output_path, 'w', newline='') as out:
+            writer = csv.writer(out)
+            writer.writerow(header)
+            writer.writerows(heapq.merge(*readers, key=lambda row: float(row[rank_idx]),
+                                         reverse=True))
+    finally:
+        for f in files:
+            f.close()
+
+
+def rank(input_path, output_path, chunk_size=100000, batch_size=4096, verbose=True):
+    """
+        Score the catalogue at input_path and write it to output_path, best deals first
+        Return: (dict) rows scored, seconds spent and rows/sec
+    """
+    run_dir = tempfile.mkdtemp(prefix='diamonds_runs_')
+    start = time.perf_counter()
+    n_rows = 0
+    try:
+        run_paths = []
+        for i, chunk in enumerate(iter_catalogue(input_path, chunk_size, SNAPSHOT_COLS)):
+            scored = score_chunk(chunk, batch_size)
+            run_path = os.path.join(run_dir, 'run_{:05d}.csv'.format(i))
+            scored.sort_values(RANK_COL, ascending=False, kind='stable').to_csv(run_path, index=False)
+            run_paths.append(run_path)
+            n_rows += len(scored)
+            if verbose:
+                elapsed = time.perf_counter() - start
+                print("Chunk {}: scored {} diamonds, {:.0f} rows/sec.".format(i, n_rows, n_rows / elapsed))
+        if run_paths:
+            _merge_runs(run_paths, output_path)
+    finally:
+        shutil.rmtree(run_dir)
+    elapsed = time.perf_counter() - start
+    stats = {'rows': n_rows, 'seconds': round(elapsed, 3),
+             'rows_per_sec': round(n_rows / elapsed, 1) if elapsed else None}
+    if verbose:
+        print("Complete: ranked {rows} diamonds in {seconds}s ({rows_per_sec} rows/sec).".format(**stats))
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score and rank a diamonds catalogue.')
+    parser.add_argument('--input', help='snapshot directory or csv file, default: latest download')
+    parser.add_argument('--output', required=True, help='ranked csv to write')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='rows read per chunk')
+    parser.add_argument('--batch-size', type=int, default=4096, help='rows per model batch')
+    parser.add_argument('--threads', type=int, default=None, help='threads used by the model')
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        registry.set_threads(args.threads)
+    input_path = args.input or update_data(DATA_DIR)[0]
+    rank(input_path, args.output, args.chunk_size, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+    Explicit keyed cache for objects shared between app reruns
+
+    Streamlit's legacy @st.cache hashes the arguments and the returned
+    objects on every rerun to detect mutation, which costs time in
+    proportion to the catalogue. Entries here are looked up by key only:
+    nothing is hashed or copied, callers get the cached object itself and
+    must treat it as read-only.
+
+    The module lives outside the Streamlit script so that its caches
+    survive reruns, like the model registry.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+from .constants import CATALOGUE_CACHE_SIZE, CATALOGUE_CACHE_TTL
+
+
+class KeyedCache:
+    """
+        Thread-safe LRU cache with an optional time to live
+
+        max_size: (int) number of entries kept, the least recently used is evicted first
+        ttl: (float) seconds an entry stays valid after it was loaded, None to keep it
+             until evicted
+        hits, misses, evictions: counters since creation or the last clear()
+    """
+
+    def __init__(self, max_size=2, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # one lock per key being loaded, so concurrent sessions load it only once
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key):
+        """Return (True, value) for a valid entry, (False, None) otherwise; caller holds the lock."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        value, loaded_at = entry
+        if self.ttl is not None and time.monotonic() - loaded_at > self.ttl:
+            del self._entries[key]
+            self.evictions += 1
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def get(self, key, loader):
+        """
+            Return the cached value of key, calling loader() to build it on a miss
+        """
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return value
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                # loaded by another thread while this one was waiting
+                found, value = self._lookup(key)
+                if found:
+                    self.hits += 1
+                    return value
+                self.misses += 1
+            try:
+                value = loader()
+            except BaseException:
+                with self._lock:
+                    self._loading.pop(key, None)
+                raise
+            with self._lock:
+                # stored before the key is no longer marked as loading, so a miss
+                # in between finds either the entry or the key lock, never neither
+                self._entries[key] = (value, time.monotonic())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+                self._loading.pop(key, None)
+        # releasing the key lock wakes the threads waiting for this load, they find the entry
+        return value
+
+    def stats(self):
+        """
+            Return: (dict) size, hits, misses and evictions
+        """
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+# catalogues loaded by the app, one entry per (snapshot, model version)
+catalogue_cache = KeyedCache(max_size=CATALOGUE_CACHE_SIZE, ttl=CATALOGUE_CACHE_TTL)
@@ -0,0 +1,173 @@
+"""
+    Graded attributes as fixed categoricals
+
+    Every graded column (color, clarity, cut, culet, polish, symmetry,
+    fluorescence) gets one pd.CategoricalDtype whose categories are the
+    grades of src.constants, worst to best. The codes of a known grade
+    therefore mean the same thing in every page, scored snapshot and
+    process: the query engine filters on them, the feature pipeline reads
+    them as ordinal/one-hot codes and snapshots store them as they are.
+
+    Raw values are normalized once per distinct value, never per row: a
+    column is factorized (or its categories read), each distinct value is
+    looked up, and the codes are gathered through the lookup table. Raw
+    fluorescence labels are mapped to their canonical grade.
+
+    A label outside the vocabulary is kept, after the known grades, so it is
+    still displayed; the features read it as unknown. Each one is counted
+    (see unmapped_labels) and logged the first time it is seen. Columns
+    normalized as strict raise on them instead, e.g. fluorescence before
+    scoring, since the model has no input for an unknown fluorescence.
+"""
+import logging
+import threading
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from .constants import ranking, fluorescence, map_fluorescence
+
+DTYPES = {key: pd.CategoricalDtype(values) for key, values in ranking.items()}
+DTYPES['fluorescence'] = pd.CategoricalDtype(fluorescence)
+GRADE_COLS = list(DTYPES)
+
+# raw fluorescence labels of the BlueNile api, other labels go through map_fluorescence once
+FLUORESCENCE_LABELS = ['None', 'Faint', 'Faint Blue', 'Medium', 'Medium Blue', 'Medium Yellow',
+                       'Strong', 'Strong Blue', 'Very Strong', 'Very Strong Blue']
+_LOOKUPS = {key: {value: code for code, value in enumerate(dtype.categories)}
+            for key, dtype in DTYPES.items()}
+_LOOKUPS['fluorescence'].update({label: _LOOKUPS['fluorescence'][map_fluorescence(label)]
+                                 for label in FLUORESCENCE_LABELS})
+
+logger = logging.getLogger('diamonds.categories')
+# (column, label) -> number of rows seen with a label outside the vocabulary
+_unmapped = Counter()
+_unmapped_lock = threading.Lock()
+
+
+def _code(col, value):
+    lookup = _LOOKUPS[col]
+    if value not in lookup:
+        if col != 'fluorescence':
+            return -1
+        canonical = map_fluorescence(value) if isinstance(value, str) else None
+        # remembered, so an unknown label is only parsed once per process
+        lookup[value] = lookup.get(canonical, -1)
+    return lookup[value]
+
+
+def lookup_table(col, values):
+    """
+        Return: (numpy array of int8) code of each of a few distinct raw values, -1 if unknown
+    """
+    return np.array([_code(col, value) for value in values], dtype=np.int8)
+
+
+def has_grade_codes(series, col):
+    """
+        Return: (bool) True if the codes of series already are the codes of DTYPES[col]
+    """
+    return isinstance(series.dtype, pd.CategoricalDtype) and \
+        series.cat.categories.equals(DTYPES[col].categories)
+
+
+def _graded(series, col):
+    """Return True if series starts with the grades of col, maybe followed by kept labels."""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return False
+    grades = DTYPES[col].categories
+    return series.cat.categories[:len(grades)].equals(grades)
+
+
+def _distinct(series):
+    """Return (codes, distinct values) of a raw or categorical column, code -1 is missing."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.values, series.cat.categories
+    return pd.factorize(series)
+
+
+def _report(col, labels, counts):
+    with _unmapped_lock:
+        new = [label for label in labels if (col, label) not in _unmapped]
+        for label, count in zip(labels, counts):
+            _unmapped[(col, label)] += int(count)
+    if new:
+        logger.warning('Unknown %s labels, outside %s: %s', col, list(DTYPES[col].categories), new)
+
+
+def unmapped_labels():
+    """
+        Return: (dict) (column, label) -> number of rows seen with a label outside the vocabulary
+    """
+    with _unmapped_lock:
+        return dict(_unmapped)
+
+
+def grade_codes(series, col):
+    """
+        Input:
+            series: raw or categorical values of the graded column col
+        Output:
+            (numpy array of int8) codes in DTYPES[col], -1 for missing or unknown values
+    """
+    if has_grade_codes(series, col):
+        return series.cat.codes.values
+    codes, uniques = _distinct(series)
+    lookup = np.append(lookup_table(col, uniques), -1)
+    return lookup[codes]
+
+
+def to_grade(series, col, strict=False):
+    """
+        Input:
+            series: raw or categorical values of the graded column col
+            strict: (bool) raise ValueError on labels outside the vocabulary instead
+                    of keeping them after the known grades
+        Output:
+            pandas series, categorical with the grades of col first, same index
+    """
+    if _graded(series, col):
+        # labels kept by an earlier pass were already reported
+        grades = DTYPES[col].categories
+        codes = series.cat.codes.values
+        if strict and (codes >= len(grades)).any():
+            extra = list(series.cat.categories[np.unique(codes[codes >= len(grades)])])
+            raise ValueError('Unknown {} {}, expected one of {}'.format(col, extra, list(grades)))
+        return series
+    codes, uniques = _distinct(series)
+    lookup = lookup_table(col, uniques)
+    categories = list(DTYPES[col].categories)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    # unused categories are not reported
+    unknown = np.flatnonzero((lookup < 0) & (counts > 0) & pd.notna(np.asarray(uniques, dtype=object)))
+    if len(unknown):
+        labels = [uniques[i] for i in unknown]
+        _report(col, labels, counts[unknown])
+        if strict:
+            raise ValueError('Unknown {} {}, expected one of {}'.format(col, labels, categories))
+        lookup[unknown] = len(categories) + np.arange(len(unknown))
+        categories += labels
+    lookup = np.append(lookup, -1)  # code -1 is NaN
+    return pd.Series(pd.Categorical.from_codes(lookup[codes], dtype=pd.CategoricalDtype(categories)),
+                     index=series.index, name=series.name)
+
+
+def normalize(df, columns=GRADE_COLS, strict=()):
+    """
+        Return: pandas dataframe with the graded columns of df recoded to their fixed grades
+        strict: (list) columns raising ValueError on a label outside the vocabulary
+    """
+    columns = [col for col in columns if col in df and
+               not (has_grade_codes(df[col], col) or _graded(df[col], col) and col not in strict)]
+    if not columns:
+        return df
+    return df.assign(**{col: to_grade(df[col], col, col in strict) for col in columns})
+
+
+def canonical_fluorescence(value):
+    """
+        Return: (string) canonical fluorescence of one raw label, None if unknown
+    """
+    code = _code('fluorescence', value)
+    return fluorescence[code] if code >= 0 else None
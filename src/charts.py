@@ -0,0 +1,79 @@
+"""
+    Carat x price scatter with a bounded payload
+
+    Up to `point_budget` diamonds are drawn as individual WebGL points. Above
+    that, the chart shows carat x price bins (size: number of diamonds,
+    color: median estimate_difference) plus the best deals as points, so the
+    figure sent to the browser no longer grows with the selection.
+"""
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+HOVER_DATA = ['cut', 'fluorescence', 'polish', 'symmetry', 'table', 'predicted_price']
+POINT_BUDGET = 5000
+N_BINS = 50
+
+
+def bin_points(df, n_bins=N_BINS, x='carat', y='price', value='estimate_difference'):
+    """
+        Aggregate df on a n_bins x n_bins grid over x and y
+        Return: pandas dataframe with bin centers x, y, 'count' and median value
+    """
+    xs, ys = df[x].values.astype(float), df[y].values.astype(float)
+    x_edges = np.linspace(xs.min(), xs.max(), n_bins + 1)
+    y_edges = np.linspace(ys.min(), ys.max(), n_bins + 1)
+    x_bin = np.clip(np.searchsorted(x_edges, xs, 'right') - 1, 0, n_bins - 1)
+    y_bin = np.clip(np.searchsorted(y_edges, ys, 'right') - 1, 0, n_bins - 1)
+    grouped = pd.DataFrame({'bin': x_bin * n_bins + y_bin, value: df[value].values}) \
+        .groupby('bin')[value].agg(['size', 'median'])
+    x_centers = (x_edges[:-1] + x_edges[1:]) / 2
+    y_centers = (y_edges[:-1] + y_edges[1:]) / 2
+    bins = grouped.index.values
+    return pd.DataFrame({x: x_centers[bins // n_bins], y: y_centers[bins % n_bins],
+                         'count': grouped['size'].values, value: grouped['median'].values})
+
+
+def build_scatter(df, top=None, point_budget=POINT_BUDGET, n_bins=N_BINS, hover_data=HOVER_DATA):
+    """
+        Input:
+            df: pandas dataframe, the selected diamonds
+            top: pandas dataframe, best deals always drawn as points in aggregated mode
+            point_budget: (int) max number of diamonds drawn individually
+            n_bins: (int) bins per axis in aggregated mode
+        Output:
+            plotly figure
+    """
+    if len(df) <= point_budget:
+        return px.scatter(df, x='carat', y='price',
+            symbol='clarity', color='color',
+            hover_name='id',
+            hover_data=hover_data,
+            render_mode='webgl'
+        )
+
+    binned = bin_points(df, n_bins)
+    size = 4 + 16 * np.sqrt(binned['count'] / binned['count'].max())
+    fig = go.Figure(go.Scattergl(
+        x=binned['carat'], y=binned['price'], mode='markers', name='binned diamonds',
+        marker=dict(size=size, color=binned['estimate_difference'], colorscale='RdYlGn',
+                    colorbar=dict(title='Median difference')),
+        customdata=np.stack([binned['count'], binned['estimate_difference']], axis=1),
+        hovertemplate='Carat ~%{x:.2f}, Price ~$%{y:,.0f}<br>'
+                      '%{customdata[0]} diamonds, median difference $%{customdata[1]:,.0f}'
+                      '<extra></extra>'
+    ))
+    if top is not None and len(top):
+        fig.add_trace(go.Scattergl(
+            x=top['carat'], y=top['price'], mode='markers', name='top deals',
+            marker=dict(size=9, color='black', symbol='star'),
+            text=top['id'],
+            customdata=top[hover_data].values,
+            hovertemplate='%{text}<br>Carat %{x}, Price $%{y}<br>' +
+                          '<br>'.join('{}: %{{customdata[{}]}}'.format(col, i)
+                                      for i, col in enumerate(hover_data)) +
+                          '<extra></extra>'
+        ))
+    fig.update_layout(xaxis_title='carat', yaxis_title='price')
+    return fig
@@ -3,15 +3,29 @@ import os
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 # DATA
 DATA_DIR = os.path.join(ROOT_DIR, 'data')
+PREDICTION_STORE_PATH = os.path.join(DATA_DIR, 'predictions.pkl')
+# shapes served by the app, None for the round diamonds catalogue only
+SHAPES = None
+# (min, max) price served for each shape, only the price bands overlapping it are
+# scored, None for everything crawled
+PRICE_RANGE = None
+# catalogues kept loaded by each app process, and seconds before one is reloaded (None: never)
+CATALOGUE_CACHE_SIZE = 2
+CATALOGUE_CACHE_TTL = None
+SHAPE_NAMES = {'RD': 'Round', 'PR': 'Princess', 'EC': 'Emerald', 'AS': 'Asscher', 'CU': 'Cushion',
+               'MQ': 'Marquise', 'RA': 'Radiant', 'OV': 'Oval', 'PS': 'Pear', 'HS': 'Heart'}
 # MODEL
 MODEL_DIR = os.path.join(ROOT_DIR, 'model')
 MODEL_PATH = os.path.join(MODEL_DIR, 'my_model.h5')
 MODEL_SCALER_PATH = os.path.join(MODEL_DIR, 'scaler.pkl')
 MODEL_WEIGHT_PATH = os.path.join(MODEL_DIR, 'weights.best.hdf5')
+# numpy export of the model above, see src.runtime
+MODEL_RUNTIME_PATH = os.path.join(MODEL_DIR, 'model.npz')
 
 # Diamond fluorescence itself is a debated topic, see https://www.leibish.com/diamond-fluorescence-article-245
 # [TODO] Explore how different pair of color + fluorescence may result in different price
 # Now we just simplify based on UV light intensity
+# applied once per distinct label, see src.categories
 def map_fluorescence(x):
     if x == 'None':
         return 'None'
@@ -0,0 +1,171 @@
+"""
+    What-if price estimates for hypothetical diamonds
+
+    estimate() scores one diamond described by its attributes, with the model
+    of its shape. Requests from concurrent sessions go through one
+    MicroBatcher per shape: the first request
+    waits at most `max_wait` seconds for others to join, then all of them
+    are scored with one model call. The model and the feature pipeline are
+    loaded once by the registry, so a warm single-row estimate costs a
+    feature transform and one forward pass.
+"""
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+import pandas as pd
+
+from .categories import canonical_fluorescence
+from .constants import ranking, fluorescence
+
+# attributes a user rarely knows, typical values of the catalogue
+DEFAULTS = {
+    'depth': 61.8,
+    'table': 57.,
+    'sellingIndex': 0.8,
+    'hasVisualization': True,
+    'culet': 'None',
+    'polish': 'Excellent',
+    'symmetry': 'Excellent',
+    'fluorescence': 'None',
+}
+
+
+def make_diamond(carat, color, clarity, cut, length, width, height, **attributes):
+    """
+        Input:
+            carat: (float)
+            color, clarity, cut: (string) values of src.constants.ranking
+            length, width, height: (float) measurements in mm
+            attributes: any other column read by prepare_input, see DEFAULTS
+        Output:
+            (dict) one row of the catalogue, ready for predict
+    """
+    diamond = dict(DEFAULTS, carat=float(carat), color=color, clarity=clarity, cut=cut, **attributes)
+    for key, values in ranking.items():
+        if diamond[key] not in values:
+            raise ValueError('Unknown {} {!r}, expected one of {}'.format(key, diamond[key], values))
+    diamond['fluorescence'] = canonical_fluorescence(diamond['fluorescence'])
+    if diamond['fluorescence'] not in fluorescence:
+        raise ValueError('Unknown fluorescence {!r}, expected one of {}'.format(
+            attributes.get('fluorescence'), fluorescence))
+    diamond['measurements'] = '{:.2f} x {:.2f} x {:.2f} mm'.format(length, width, height)
+    diamond.setdefault('lxwRatio', round(max(length, width) / min(length, width), 2))
+    return diamond
+
+
+class MicroBatcher:
+    """
+        Coalesce concurrent scoring requests into batches
+
+        predict_fn: function(dataframe) -> array of one prediction per row
+        max_batch_size: (int) max rows scored by one call
+        max_wait: (float) seconds the first request of a batch waits for others
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait=0.001):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.n_batches = 0
+        self.n_rows = 0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='diamonds-estimator', daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        """Block for one request, then take more until the batch is full or max_wait is over."""
+        batch = [self._queue.get()]
+        n_rows = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while n_rows < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            n_rows += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                frames = [df for df, _ in batch]
+                df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+                predictions = self.predict_fn(df)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.n_batches += 1
+            self.n_rows += len(df)
+            start = 0
+            for frame, future in batch:
+                future.set_result(predictions[start:start + len(frame)])
+                start += len(frame)
+
+    def submit(self, df):
+        """
+            Queue the rows of df for scoring
+            Return: concurrent.futures.Future of the predictions, in row order
+        """
+        future = Future()
+        self._queue.put((df, future))
+        self._start()
+        return future
+
+
+def _predict_fn(shape):
+    def predict_fn(df):
+        # imported here so that building diamonds does not load the model
+        from .inference import predict
+        return predict(df, shape=shape)
+    return predict_fn
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def _batcher(shape=None):
+    # a batch is scored by one model, so requests are batched per shape
+    with _batchers_lock:
+        if shape not in _batchers:
+            _batchers[shape] = MicroBatcher(_predict_fn(shape))
+        return _batchers[shape]
+
+
+def estimate_many(diamonds, timeout=10, shape=None):
+    """
+        Input:
+            diamonds: list of dicts built by make_diamond
+            shape: (string) shape code of the diamonds, selects the model, see registry_for
+        Output:
+            (numpy array) predicted price of each diamond
+    """
+    return _batcher(shape).submit(pd.DataFrame(diamonds)).result(timeout)
+
+
+def estimate(diamond, timeout=10, shape=None):
+    """
+        Return: (float) predicted price of one diamond built by make_diamond
+    """
+    return float(estimate_many([diamond], timeout, shape)[0])
+
+
+def warm(shape=None):
+    """
+        Load the model and run one estimate, e.g. at app startup
+    """
+    return estimate(make_diamond(1., 'G', 'VS1', 'Ideal', 6.4, 6.4, 4.), shape=shape)
@@ -0,0 +1,167 @@
+"""
+    Fitted-once feature pipeline for the price model
+
+    Produces exactly what the original prepare_input did (measurements split,
+    ordinal codes, degree 2 polynomials, MinMax scaling, one-hot fluorescence,
+    hasVisualization) without refitting encoders on every call.
+"""
+import re
+import pickle
+import numpy as np
+import pandas as pd
+from .constants import ranking, fluorescence
+
+NUM_COLS = ['carat', 'depth', 'lxwRatio', 'table', 'sellingIndex', 'length', 'width', 'height']
+_MEASUREMENTS_ROW = r'[^ \n]+ x [^ \n]+ x [^ \n]+(?: mm)?'
+# every row of a newline-joined column is well formed
+_MEASUREMENTS_TEXT = re.compile(r'(?:{0}\n)*{0}'.format(_MEASUREMENTS_ROW))
+_MEASUREMENTS_GROUPS = r'^(\S+) x (\S+) x (\S+?)(?: mm)?$'
+# below this many rows, per-call overhead dominates: python lookups instead of a
+# pandas Categorical, all polynomial terms in one shot instead of column by column
+SMALL_ROWS = 256
+
+
+def category_codes(series, categories):
+    """
+        Return: (numpy array of int) position of each value in categories, -1 if absent
+        Categoricals are recoded through their (few) categories, not per row,
+        and the fixed categoricals of src.categories already hold the codes.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        if list(series.cat.categories) == list(categories):
+            return series.cat.codes.values
+        lookup = pd.Index(categories).get_indexer(series.cat.categories)
+        codes = series.cat.codes.values
+        return np.where(codes >= 0, lookup[codes], -1)
+    if len(series) <= SMALL_ROWS:
+        lookup = {value: code for code, value in enumerate(categories)}
+        return np.array([lookup.get(value, -1) for value in series.tolist()], dtype=np.int8)
+    return pd.Categorical(series, categories=categories).codes
+
+
+def parse_measurements(series):
+    """
+        Split '6.45 x 6.42 x 3.98 mm' into length, width, height
+        Return: (numpy array) float64 of shape (n, 3)
+
+        The whole column is joined, validated by one regex pass and parsed
+        by a single pd.to_numeric call. Columns with missing or malformed
+        values go through the per-row regex, leaving NaN for bad rows.
+    """
+    values = series.to_numpy(dtype=object)
+    try:
+        text = '\n'.join(values)
+    except TypeError:
+        text = None
+    if text is not None and len(values) and _MEASUREMENTS_TEXT.fullmatch(text):
+        tokens = text.replace(' mm', '').replace(' x ', '\n').split('\n')
+        return pd.to_numeric(np.array(tokens, dtype=object)).reshape(-1, 3).astype(np.float64)
+    parts = pd.Series(values, dtype=object).str.extract(_MEASUREMENTS_GROUPS)
+    return parts.apply(pd.to_numeric).values.astype(np.float64)
+
+
+def load_scaler(path):
+    """
+        Return: the fitted MinMaxScaler pickled at path
+        Pickles of scikit-learn < 0.24 have no clip attribute, which transform
+        reads since; those versions never clipped.
+    """
+    with open(path, 'rb') as f:
+        scaler = pickle.load(f)
+    if not hasattr(scaler, 'clip'):
+        scaler.clip = False
+    return scaler
+
+
+class FeatureTransformer:
+    """
+        Model input builder, holding the fitted MinMax scaler
+
+        The polynomial terms are computed one column at a time, scaled in
+        float64 exactly like MinMaxScaler.transform, and written straight
+        into a preallocated float32 matrix.
+    """
+
+    def __init__(self, scaler, ranking=ranking, fluorescence=fluorescence):
+        self.ranking = {key: list(values) for key, values in ranking.items()}
+        self.fluorescence = list(fluorescence)
+        self.scale = np.asarray(scaler.scale_, dtype=np.float64)
+        self.offset = np.asarray(scaler.min_, dtype=np.float64)
+        self.clip = getattr(scaler, 'clip', False)
+        self.feature_range = scaler.feature_range
+        n_base = len(NUM_COLS) + len(self.ranking)
+        # same column order as PolynomialFeatures(degree=2, include_bias=False)
+        self.terms = [(i, None) for i in range(n_base)] + \
+            [(i, j) for i in range(n_base) for j in range(i, n_base)]
+        if len(self.terms) != len(self.scale):
+            raise ValueError('Scaler expects {} features, pipeline builds {}'.format(
+                len(self.scale), len(self.terms)))
+        # linear terms are multiplied by a column of ones, x * 1. is exact
+        self._left = np.array([i for i, _ in self.terms])
+        self._right = np.array([n_base if j is None else j for _, j in self.terms])
+        self.n_features = len(self.terms) + len(self.fluorescence) + 1
+
+    def base_features(self, df):
+        """
+            Return: (numpy array) float64 of shape (n, 14), numerical + ordinal columns
+        """
+        n = len(df)
+        x = np.empty((n, len(NUM_COLS) + len(self.ranking)), dtype=np.float64, order='F')
+        for k, col in enumerate(NUM_COLS[:5]):
+            x[:, k] = df[col].values
+        x[:, 5:8] = parse_measurements(df['measurements'])
+        for k, (key, values) in enumerate(self.ranking.items(), len(NUM_COLS)):
+            codes = category_codes(df[key], values)
+            x[:, k] = np.where(codes >= 0, codes, np.nan)
+        return x
+
+    def transform(self, df):
+        """
+            Input:
+                df: pandas dataframe
+            Output:
+                (numpy array) float32 model input of shape (n, n_features)
+        """
+        x = self.base_features(df)
+        n = len(x)
+        n_poly = len(self.terms)
+        out = np.empty((n, self.n_features), dtype=np.float32, order='F')
+        if n <= SMALL_ROWS:
+            x = np.hstack([x, np.ones((n, 1))])
+            poly = x[:, self._left]
+            poly *= x[:, self._right]
+            poly *= self.scale
+            poly += self.offset
+            if self.clip:
+                np.clip(poly, self.feature_range[0], self.feature_range[1], out=poly)
+            out[:, :n_poly] = poly
+        else:
+            tmp = np.empty(n, dtype=np.float64)
+            for k, (i, j) in enumerate(self.terms):
+                if j is None:
+                    tmp[:] = x[:, i]
+                else:
+                    np.multiply(x[:, i], x[:, j], out=tmp)
+                tmp *= self.scale[k]
+                tmp += self.offset[k]
+                if self.clip:
+                    np.clip(tmp, self.feature_range[0], self.feature_range[1], out=tmp)
+                out[:, k] = tmp
+
+        codes = category_codes(df['fluorescence'], self.fluorescence)
+        if (codes < 0).any():
+            unknown = pd.unique(np.asarray(df['fluorescence'], dtype=object)[codes < 0])
+            raise ValueError('Found unknown fluorescence {} during transform'.format(list(unknown)))
+        out[:, n_poly:n_poly + len(self.fluorescence)] = 0
+        out[np.arange(n), n_poly + codes] = 1
+        out[:, -1] = df['hasVisualization'].astype(int).values
+        return out
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
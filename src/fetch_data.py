@@ -3,11 +3,23 @@
 
 """
 import os, re, time
+import random
+from operator import itemgetter
 import glob
+import shutil
 import json
+import threading
 import requests
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from .snapshot import (SNAPSHOT_COLS, SNAPSHOT_EXT, CATEGORY_COLS,
+                       SnapshotWriter, read_snapshot, write_snapshot)
+from .categories import normalize
+from .history import History
+from .partitions import PartitionedWriter
 
 # just a referrence for param options
 param_options = {
@@ -36,11 +48,138 @@ required_params = {
     'minPrice': 10000,
     'maxPrice': 30000
 }
+# default price range of a multi-shape crawl, see update_catalogue
+CATALOGUE_PRICE_RANGE = (1000, 100000)
 
 
 def _price_to_int(s):
     return int(re.sub('[$,]', '', s))
 
+def _unwrap(x):
+    return x[0] if isinstance(x, list) else x
+
+
+# columns kept from each api result, everything else is dropped as pages arrive
+PAGE_COLS = SNAPSHOT_COLS + ['pricePerCarat']
+
+
+def normalize_page(results):
+    """
+        Turn one page of raw api results into a typed dataframe
+        Input:
+            results: (list) raw diamond dicts, values wrapped in lists
+        Output:
+            pandas dataframe with PAGE_COLS: prices as int, sizes as float,
+            graded attributes as the fixed categoricals of src.categories,
+            fluorescence as its raw api label
+    """
+    # new: return data all wrapped in a list - so always extract first element
+    df = pd.DataFrame({col: [_unwrap(x.get(col)) for x in results] for col in PAGE_COLS})
+    for col in ['carat', 'depth', 'lxwRatio', 'table']:
+        df[col] = df[col].astype(str).str.replace(',', '', regex=False).astype(float)
+    for col in ['price', 'pricePerCarat']:
+        df[col] = df[col].astype(str).str.replace('[$,]', '', regex=True).astype(np.int64)
+    for col in ['cut', 'measurements']:
+        # one C level pass, no python code per cell
+        df[col] = list(map(itemgetter('label'), df[col].values))
+    df = _categorize(df)
+    df['sellingIndex'] = df['sellingIndex'].astype(float)
+    df['hasVisualization'] = df['hasVisualization'].astype(bool)
+    return df
+
+
+def _categorize(df):
+    # the raw fluorescence label is stored and mapped to its canonical grade when scored
+    df = normalize(df, [col for col in CATEGORY_COLS if col != 'fluorescence'])
+    df['fluorescence'] = df['fluorescence'].astype('category')
+    return df
+
+
+def _concat_pages(pages):
+    df = pd.concat(pages, ignore_index=True)
+    # the fixed grades come first in every page, labels kept by some pages follow
+    for col in CATEGORY_COLS:
+        df[col] = union_categoricals([page[col].values for page in pages])
+    return df
+
+
+class RateLimiter:
+    """
+        Space out requests shared by several threads
+        rate: (float) max number of requests per second, None for no limit
+    """
+    def __init__(self, rate=None):
+        self.interval = 1. / rate if rate else 0.
+        self._lock = threading.Lock()
+        self._next_time = 0.
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time)
+            self._next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class CrawlCheckpoint:
+    """
+        Progress of a crawl saved on disk
+
+        path: (string) checkpoint directory, holds one snapshot per fetched page
+              and cursor.json with, for each crawl key, the minPrice of the next
+              page, the saved pages and whether the crawl is done
+
+        A page is written before the cursor that points past it, so a crash
+        between the two only refetches that page.
+    """
+    CURSOR_FILE = 'cursor.json'
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(os.path.join(path, self.CURSOR_FILE)) as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = {}
+
+    def cursor(self, key):
+        return self.state.get(key)
+
+    def pages(self, key):
+        """
+            Yield the pages saved for key, in crawl order
+        """
+        for name in (self.cursor(key) or {}).get('pages', []):
+            yield read_snapshot(os.path.join(self.path, name), mmap=False)
+
+    def save(self, key, page, min_price, done):
+        """
+            Save one page of the crawl key and move its cursor to min_price
+        """
+        with self._lock:
+            cursor = self.state.get(key, {'pages': []})
+            name = '{}-{:05d}{}'.format(key, len(cursor['pages']), SNAPSHOT_EXT)
+        os.makedirs(self.path, exist_ok=True)
+        write_snapshot(page, os.path.join(self.path, name), PAGE_COLS, verbose=False)
+        with self._lock:
+            self.state[key] = {'minPrice': int(min_price), 'done': bool(done),
+                               'pages': cursor['pages'] + [name], 'n_pages': len(cursor['pages']) + 1}
+            tmp_path = os.path.join(self.path, self.CURSOR_FILE + '.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, os.path.join(self.path, self.CURSOR_FILE))
+
+    def clear(self):
+        """
+            Remove the checkpoint once the crawl output is safely written
+        """
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        self.state = {}
+
+
 class Diamonds:
     """
         Get Diamonds data from BlueNile API
@@ -49,12 +188,31 @@ class Diamonds:
         To get around this, use price to page thru results. ie.
         1. Get first 1000 diamonds
         2. Use diamond with highest price to seed the next query
+
+        Each page is normalized into a typed dataframe as soon as it arrives.
+        Pages are kept in memory for clean(), or handed to page_sink (e.g.
+        SnapshotWriter.append) so that memory is bounded by one page.
+
+        Requests go through one requests.Session, so the connection is kept
+        alive between pages. A failed request is retried after an exponential
+        backoff with jitter. With a CrawlCheckpoint, every page and the
+        minPrice cursor are saved to disk, and an interrupted crawl resumes
+        where it stopped instead of starting over.
     """
     HOME_URL = 'http://www.bluenile.com'
     API_URL = 'http://www.bluenile.com/api/public/diamond-search-grid/v2'
 
-    def __init__(self):
-        self.result = []
+    def __init__(self, home_url=None, api_url=None, page_sink=None, retry=(8, 2., 300.)):
+        # urls can be pointed to a local fake api server for offline runs
+        self.home_url = home_url or self.HOME_URL
+        self.api_url = api_url or self.API_URL
+        self.page_sink = page_sink
+        # (max retries per page, first backoff in seconds, max backoff in seconds)
+        self.retry = retry
+        self.pages = []
+        self.n_diamonds = 0
+        # bands fetched in parallel hand their pages to page_sink one at a time
+        self._page_lock = threading.Lock()
         self.df = None
         self.complete = False
         self.params = {
@@ -70,74 +228,176 @@ class Diamonds:
     def addParams(self, params={}):
         self.params.update(params)
 
-    def download(self):
-        # may run into sslerror issue in this step, in case that happens, 
+    def _add_page(self, page):
+        if self.page_sink is None:
+            self.pages.append(page)
+        else:
+            self.page_sink(page)
+        self.n_diamonds += len(page)
+
+    def _session(self, pool_size=1):
+        """
+            Return: requests.Session keeping its connections alive between pages,
+                    with the landing page cookies
+        """
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        # may run into sslerror issue in this step, in case that happens,
         # reinstall requests package with a different version
-        landing_page = requests.get(self.HOME_URL)
-        i = 0
-        while True:
-            try:
-                response = requests.get(self.API_URL, self.params, cookies=landing_page.cookies)
-            except:
-                # if timeout
-                time.sleep(30)
-                next
-            if not response.ok:
-                # if server disconnected
-                time.sleep(30)
-            else:
-                time.sleep(15)
-                next
+        session.get(self.home_url, timeout=60)
+        return session
 
+    def _get_page(self, session, params, limiter=None):
+        """
+            Fetch one page of api results, retrying failed requests after an
+            exponential backoff with full jitter (see Diamonds.retry)
+            Return: (dict) decoded api response with 'results' and 'countRaw'
+        """
+        max_retries, backoff, max_backoff = self.retry
+        for attempt in range(max_retries + 1):
+            if limiter is not None:
+                limiter.wait()
             try:
-                d = json.loads(response.text)
-                # new: return data all wrapped in a list - so always extract first element
-                min_price = _price_to_int(d['results'][0]['price'][0])
-                max_price = _price_to_int(d['results'][-1]['price'][0])
-            except Exception as e:
-                print(response.text)
-                print(e)
-                next
+                response = session.get(self.api_url, params=params, timeout=60)
+                response.raise_for_status()
+                d = response.json()
+                if 'results' not in d or 'countRaw' not in d:
+                    raise ValueError('unexpected response: {}'.format(response.text[:200]))
+                return d
+            except (requests.RequestException, ValueError) as e:
+                if attempt == max_retries:
+                    raise
+                wait = random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+                print("Request from ${} failed ({}), retry {} in {:.1f}s.".format(
+                    params.get('minPrice'), e, attempt + 1, wait))
+                time.sleep(wait)
 
-            last_page = self.params['pageSize'] >= d['countRaw']
-            print("Number of remaining: {}".format(d['countRaw']))
-            if last_page:
-                self.result += d['results']
-                break
-            else:
+    def _crawl(self, session, params, key, checkpoint=None, limiter=None, delay=0):
+        """
+            Page through the diamonds matching params by raising minPrice
+            key: (string) name of the crawl in the checkpoint
+            Yield: normalized pages, the ones saved in the checkpoint first
+        """
+        params = dict(params)
+        if checkpoint is not None:
+            for page in checkpoint.pages(key):
+                yield page
+            cursor = checkpoint.cursor(key)
+            if cursor is not None:
+                if cursor['done']:
+                    return
+                params['minPrice'] = cursor['minPrice']
+                print("Resume {} from ${} after {} pages.".format(key, cursor['minPrice'], cursor['n_pages']))
+        while True:
+            d = self._get_page(session, params, limiter)
+            page = normalize_page(d['results'])
+            last_page = params['pageSize'] >= d['countRaw']
+            if not last_page:
+                min_price, max_price = page['price'].iloc[0], page['price'].iloc[-1]
                 assert min_price < max_price, 'Min price bigger than max price'
-                # only add diamonds with price lower than max
-                self.result += [x for x in d['results'] if _price_to_int(x['price'][0]) < max_price]
-                self.params['minPrice'] = max_price
-                i += 1
-                print("Iter {}: added {} diamonds".format(i, len(self.result)))
-        print("Complete: downloaded {} diamonds for given characteristics.".format(len(self.result)))
+                # only keep diamonds with price lower than max, the next page starts at max
+                page = page[page['price'] < max_price]
+                params['minPrice'] = int(max_price)
+            if checkpoint is not None:
+                checkpoint.save(key, page, params['minPrice'], last_page)
+            yield page
+            if last_page:
+                return
+            print("Number of remaining: {}".format(d['countRaw']))
+            time.sleep(delay)
+
+    def download(self, delay=15, checkpoint=None):
+        """
+            Fetch pages one after the other over a single kept-alive connection
+            delay: (float) seconds between two pages
+            checkpoint: CrawlCheckpoint, resume an interrupted crawl and save its progress
+        """
+        with self._session() as session:
+            for i, page in enumerate(self._crawl(session, self.params, 'all', checkpoint, delay=delay)):
+                self._add_page(page)
+                print("Iter {}: added {} diamonds".format(i + 1, self.n_diamonds))
+        print("Complete: downloaded {} diamonds for given characteristics.".format(self.n_diamonds))
+
+    def _download_band(self, session, limiter, min_price, max_price, checkpoint=None):
+        """
+            Page through diamonds priced within [min_price, max_price], each page
+            is added as soon as it arrives, so memory is bounded by a page per band
+            Return: (int) number of pages of the band
+        """
+        params = dict(self.params, minPrice=min_price, maxPrice=max_price)
+        key = 'band-{}-{}'.format(min_price, max_price)
+        n_pages = 0
+        for page in self._crawl(session, params, key, checkpoint, limiter):
+            with self._page_lock:
+                self._add_page(page)
+            n_pages += 1
+        return n_pages
+
+    def download_parallel(self, n_bands=8, max_workers=4, rate_limit=1., checkpoint=None):
+        """
+            Split [minPrice, maxPrice] into price bands and fetch them concurrently
+
+            n_bands: (int) number of equal-width price bands
+            max_workers: (int) number of bands fetched at the same time
+            rate_limit: (float) max requests per second over all workers, None for no limit
+            checkpoint: CrawlCheckpoint, each band resumes from its own cursor
+        """
+        min_price, max_price = self.params['minPrice'], self.params['maxPrice']
+        width = (max_price - min_price) / n_bands
+        edges = [int(round(min_price + i * width)) for i in range(n_bands)] + [max_price]
+        bands = [(lo, hi) for lo, hi in zip(edges[:-1], edges[1:]) if lo < hi]
+
+        limiter = RateLimiter(rate_limit)
+        # one pooled connection per worker, cookies shared by all of them
+        with self._session(pool_size=max_workers) as session:
+            # neighbouring bands share their border price, duplicates are dropped by id on clean/close
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                list(pool.map(lambda band: self._download_band(session, limiter, *band, checkpoint=checkpoint),
+                              bands))
+        print("Complete: downloaded {} diamonds in {} price bands.".format(self.n_diamonds, len(bands)))
 
     def clean(self):
-        # Put the data into a data frame.
-        df = pd.DataFrame(self.result)
-        df = df.applymap(lambda x: x[0] if isinstance(x, list) else x)
-
-        # Clean up the data.
-        for col in ['carat', 'depth', 'lxwRatio', 'table']:
-            df[col] = df[col].map(lambda s: s.replace(',', '')).astype(float)
-        for col in ['price', 'pricePerCarat']:
-            df[col] = df[col].map(_price_to_int)
-        for col in ['cut', 'measurements']:
-            df[col] = df[col].map(lambda s: s['label'])
-        print("Complete: cleaned diamonds data and convert to pandas DataFrame.")
-        self.df = df
+        # pages are already typed, only put them together
+        if self.page_sink is None:
+            df = _concat_pages(self.pages) if self.pages else normalize_page([])
+            self.df = df.drop_duplicates('id', ignore_index=True)
+            self.pages = []
+            print("Complete: cleaned diamonds data and convert to pandas DataFrame.")
         self.complete = True
 
     def writeCSV(self, path):
         self.df.to_csv(path, index=False)
         print("Complete: write to {}.".format(path))
 
+    def writeSnapshot(self, path):
+        write_snapshot(self.df, path)
+
+
+def _file_date(path):
+    return os.path.basename(path).split('_')[1].split('.')[0]
 
-def update_data(data_dir):
+
+def record_history(data_dir, output_path, current_date, oldfile_list):
+    """
+        Add the new download to the history of data_dir, see src.history
+        The last older download is recorded first if the history is empty.
     """
-        Download Diamonds data and clean historical data
-        In case update failed, use the last existing csv file
+    history = History(os.path.join(data_dir, 'history'))
+    previous_path = oldfile_list[-1] if oldfile_list else None
+    if previous_path and not history.dates:
+        history.record(previous_path, _file_date(previous_path))
+    history.record(output_path, current_date, previous_path)
+
+
+def update_data(data_dir, parallel=False, fmt='snapshot'):
+    """
+        Download Diamonds data, fold older downloads into the price history
+        (see src.history) and remove them
+        In case update failed, use the last existing data file
+        parallel: (bool) fetch price bands concurrently, see Diamonds.download_parallel
+        fmt: (string) 'snapshot' for the columnar format, 'csv' for a csv export
         Return: 
             1) (string) new data file path
             2) (string): download status
@@ -146,26 +406,97 @@ def update_data(data_dir):
         os.makedirs(data_dir)
     
     current_date = datetime.today().strftime('%Y%m%d')
-    output_path = os.path.join(data_dir, 'diamonds_{}.csv'.format(current_date))
+    ext = SNAPSHOT_EXT if fmt == 'snapshot' else '.csv'
+    output_path = os.path.join(data_dir, 'diamonds_{}{}'.format(current_date, ext))
     resp = ''
     if os.path.exists(output_path):
         resp = 'Diamonds data is already the latest copy: {}.'.format(current_date)
     else:
-        # download diamonds data set
-        diamonds = Diamonds()
+        # download diamonds data set, snapshots are written page by page
+        writer = SnapshotWriter(output_path) if fmt == 'snapshot' else None
+        # pages fetched by an interrupted update of the same day are reused
+        checkpoint = CrawlCheckpoint(os.path.join(data_dir, 'crawl_{}'.format(current_date)))
+        diamonds = Diamonds(page_sink=writer.append if writer else None)
         diamonds.addParams(required_params)
-        diamonds.download()
-        diamonds.clean()
-        oldfile_list = glob.glob(os.path.join(data_dir, "*.csv"))
+        error = None
+        try:
+            if parallel:
+                diamonds.download_parallel(checkpoint=checkpoint)
+            else:
+                diamonds.download(checkpoint=checkpoint)
+            diamonds.clean()
+        except Exception as e:
+            # pages fetched so far stay in the checkpoint, the next update resumes from them
+            error = e
+            print("Download failed ({}), fetched pages are kept in {}.".format(e, checkpoint.path))
+            if writer:
+                writer.discard()
+        oldfile_list = sorted(glob.glob(os.path.join(data_dir, "diamonds_*.csv")) +
+                              glob.glob(os.path.join(data_dir, "diamonds_*" + SNAPSHOT_EXT)))
         if diamonds.complete:
-            # remove older data files
-            for f in oldfile_list:
-                os.remove(f)
-            diamonds.writeCSV(output_path)
+            if writer:
+                writer.close()
+            else:
+                diamonds.writeCSV(output_path)
+            checkpoint.clear()
+            for stale in glob.glob(os.path.join(data_dir, 'crawl_[0-9]*')):
+                shutil.rmtree(stale)
+            # older downloads are folded into the price history, then removed
+            try:
+                record_history(data_dir, output_path, current_date, oldfile_list)
+            except Exception as e:
+                print("History update failed ({}), older data files are kept.".format(e))
+            else:
+                for f in oldfile_list:
+                    if os.path.isdir(f):
+                        shutil.rmtree(f)
+                    else:
+                        os.remove(f)
             resp = 'Diamond data is updated to: {}.'.format(current_date)
         else:
+            if not oldfile_list:
+                raise error
             output_path = oldfile_list[-1]
             resp = 'Dimond data download for {} failed, use {} by default.'.format(current_date, output_path)
     print(resp)
     return output_path, resp
 
+
+def update_catalogue(data_dir, shapes=param_options['shape'], min_price=CATALOGUE_PRICE_RANGE[0],
+                     max_price=CATALOGUE_PRICE_RANGE[1], parallel=False, keep=2):
+    """
+        Download several shapes over a price range into a catalogue partitioned
+        by shape and price band, see src.partitions
+        keep: (int) number of partitioned catalogues left on disk
+        Return:
+            1) (string) catalogue directory
+            2) (string) download status
+    """
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+
+    current_date = datetime.today().strftime('%Y%m%d')
+    output_path = os.path.join(data_dir, 'catalogue_{}'.format(current_date))
+    if os.path.exists(output_path):
+        resp = 'Diamonds catalogue is already the latest copy: {}.'.format(current_date)
+        print(resp)
+        return output_path, resp
+
+    writer = PartitionedWriter(output_path)
+    checkpoint = CrawlCheckpoint(os.path.join(data_dir, 'crawl_catalogue_{}'.format(current_date)))
+    for shape in shapes:
+        # one crawl per shape, each page is routed to its price band
+        diamonds = Diamonds(page_sink=writer.sink(shape))
+        diamonds.addParams(dict(required_params, shape=shape, minPrice=min_price, maxPrice=max_price))
+        if parallel:
+            diamonds.download_parallel(checkpoint=CrawlCheckpoint(os.path.join(checkpoint.path, shape)))
+        else:
+            diamonds.download(checkpoint=CrawlCheckpoint(os.path.join(checkpoint.path, shape)))
+        diamonds.clean()
+    writer.close()
+    checkpoint.clear()
+    for old in sorted(glob.glob(os.path.join(data_dir, 'catalogue_*[0-9]')))[:-keep]:
+        shutil.rmtree(old)
+    resp = 'Diamond catalogue of {} shapes is updated to: {}.'.format(len(shapes), current_date)
+    print(resp)
+    return output_path, resp
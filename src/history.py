@@ -0,0 +1,267 @@
+"""
+    Price history of the catalogue
+
+    Instead of keeping every daily download, the history directory holds:
+        base_<date>.snap: full catalogue, written on the first day and then
+                          every `checkpoint_every` days as a checkpoint
+        delta_<date>.snap: rows added, removed or changed since the previous
+                           day, keyed by id; a 'change' column says which
+                           (removed rows keep their last known values)
+        events_<date>.snap: every price event (base, added, price, removed) up
+                            to a checkpoint date, sorted by id then date
+        events_part_<date>.snap: the price events of one later day, sorted by id
+        history.json: manifest of the files above
+
+    The catalogue as of a date is the closest checkpoint before it plus at
+    most `checkpoint_every` deltas, never a replay from the first day. A day
+    only writes its own events part; the parts are merged into the sorted
+    events when a checkpoint is written, so the whole event history is only
+    rewritten every `checkpoint_every` days. The price history of a diamond
+    is a binary search in the events and in each part.
+
+    python -m src.history --id LD12345678
+    python -m src.history --as-of 20200131 --output catalogue.csv
+"""
+import os
+import json
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+
+from .constants import DATA_DIR
+from .snapshot import (SNAPSHOT_COLS, SNAPSHOT_EXT, DictionaryColumn,
+                       load_catalogue, read_snapshot, write_snapshot)
+
+HISTORY_DIR = os.path.join(DATA_DIR, 'history')
+MANIFEST_FILE = 'history.json'
+EVENT_COLS = ['id', 'date', 'price', 'change']
+
+
+def diff_catalogues(old, new, columns=SNAPSHOT_COLS):
+    """
+        Input:
+            old, new: pandas dataframes of two consecutive days
+        Output:
+            pandas dataframe of the rows of new that were added or changed ('added',
+            'price' when the price moved, 'updated' otherwise) and of the rows of old
+            that were removed ('removed'), in a 'change' column
+    """
+    columns = [col for col in columns if col in old.columns and col in new.columns]
+    old = old[columns].drop_duplicates('id').set_index('id')
+    new = new[columns].drop_duplicates('id').set_index('id')
+    common = new.index.intersection(old.index)
+    before, after = old.loc[common], new.loc[common]
+    changed = np.zeros(len(common), dtype=bool)
+    for col in before.columns:
+        a = np.asarray(before[col], dtype=object)
+        b = np.asarray(after[col], dtype=object)
+        changed |= ~((a == b) | (pd.isna(a) & pd.isna(b)))
+    price_changed = before['price'].values != after['price'].values
+
+    parts = [new.loc[new.index.difference(old.index)].assign(change='added'),
+             after[changed].assign(change=np.where(price_changed[changed], 'price', 'updated')),
+             old.loc[old.index.difference(new.index)].assign(change='removed')]
+    return pd.concat(parts).reset_index()
+
+
+def apply_delta(catalogue, delta):
+    """
+        Return: pandas dataframe, catalogue with the rows of delta added, replaced or removed
+    """
+    columns = list(catalogue.columns)
+    kept = catalogue[~catalogue['id'].isin(delta['id'])]
+    current = delta.loc[delta['change'] != 'removed', columns]
+    return pd.concat([kept, current], ignore_index=True)
+
+
+class History:
+    """
+        path: (string) history directory
+        checkpoint_every: (int) deltas between two full checkpoints, bounds the
+                          replay needed to rebuild any date
+    """
+
+    def __init__(self, path=HISTORY_DIR, checkpoint_every=30):
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        try:
+            with open(os.path.join(path, MANIFEST_FILE)) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {'checkpoints': [], 'deltas': []}
+        # date of the merged events, dates of the daily parts written since
+        self.manifest.setdefault('events', None)
+        self.manifest.setdefault('event_parts', [])
+        self._ids = {}
+
+    @property
+    def dates(self):
+        return sorted(set(self.manifest['checkpoints']) | set(self.manifest['deltas']))
+
+    def _file(self, kind, date):
+        return os.path.join(self.path, '{}_{}{}'.format(kind, date, SNAPSHOT_EXT))
+
+    def _save_manifest(self):
+        tmp_path = os.path.join(self.path, MANIFEST_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST_FILE))
+
+    def _event_files(self):
+        """Return the events snapshots, oldest first: the merged events, then the daily parts."""
+        files = [self._file('events', self.manifest['events'])] if self.manifest['events'] else []
+        return files + [self._file('events_part', d) for d in self.manifest['event_parts']]
+
+    def _add_events(self, rows, date):
+        """Write the price events of rows as the events part of date."""
+        events = pd.DataFrame({'id': np.asarray(rows['id'], dtype=object),
+                               'date': np.full(len(rows), int(date), dtype=np.int32),
+                               'price': rows['price'].values,
+                               'change': np.asarray(rows['change'], dtype=object)})
+        # sorted by id, the dictionary of the id column comes out sorted too, see _lookup
+        events = events.sort_values('id', kind='stable', ignore_index=True)
+        write_snapshot(events, self._file('events_part', date), columns=EVENT_COLS, verbose=False)
+        self.manifest['event_parts'].append(date)
+
+    def _compact_events(self, date):
+        """
+            Merge the events and the daily parts into events_<date>.snap
+            The old files are only removed once the manifest points at the new one.
+        """
+        old_files = self._event_files()
+        events = pd.concat([read_snapshot(path, mmap=False) for path in old_files], ignore_index=True)
+        events = events.sort_values(['id', 'date'], kind='stable', ignore_index=True)
+        write_snapshot(events, self._file('events', date), columns=EVENT_COLS, verbose=False)
+        self.manifest['events'] = date
+        self.manifest['event_parts'] = []
+        self._save_manifest()
+        self._ids = {}
+        for path in old_files:
+            if path != self._file('events', date):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def record(self, catalogue_path, date, previous_path=None):
+        """
+            Add the catalogue downloaded on date to the history
+            previous_path: catalogue of the previous recorded day, rebuilt from the
+                           history when missing
+            Return: (string) 'checkpoint', 'delta' or None if the date is already recorded
+        """
+        date = str(date)
+        if date in self.dates:
+            return None
+        if self.dates and date < self.dates[-1]:
+            raise ValueError('Cannot record {} before {}'.format(date, self.dates[-1]))
+        os.makedirs(self.path, exist_ok=True)
+        new = load_catalogue(catalogue_path, SNAPSHOT_COLS)
+
+        if not self.manifest['checkpoints']:
+            write_snapshot(new, self._file('base', date))
+            self._add_events(new.assign(change='base'), date)
+            self.manifest['checkpoints'].append(date)
+            self._compact_events(date)
+            return 'checkpoint'
+
+        if previous_path and os.path.exists(previous_path):
+            old = load_catalogue(previous_path, SNAPSHOT_COLS)
+        else:
+            old = self.as_of(self.dates[-1])
+        delta = diff_catalogues(old, new)
+        write_snapshot(delta, self._file('delta', date), columns=SNAPSHOT_COLS + ['change'])
+        self._add_events(delta[delta['change'] != 'updated'], date)
+        self.manifest['deltas'].append(date)
+        kind = 'delta'
+        last_checkpoint = self.manifest['checkpoints'][-1]
+        if sum(d > last_checkpoint for d in self.manifest['deltas']) >= self.checkpoint_every:
+            write_snapshot(new, self._file('base', date))
+            self.manifest['checkpoints'].append(date)
+            kind = 'checkpoint'
+        self._save_manifest()
+        if kind == 'checkpoint':
+            self._compact_events(date)
+        print("Complete: recorded {} in history ({} rows changed).".format(date, len(delta)))
+        return kind
+
+    def as_of(self, date):
+        """
+            Return: pandas dataframe, the catalogue as downloaded on the last recorded day <= date
+        """
+        date = str(date)
+        checkpoints = [d for d in self.manifest['checkpoints'] if d <= date]
+        if not checkpoints:
+            raise KeyError('No history before {}'.format(date))
+        checkpoint = checkpoints[-1]
+        catalogue = read_snapshot(self._file('base', checkpoint), SNAPSHOT_COLS, mmap=False)
+        for delta_date in sorted(d for d in self.manifest['deltas'] if checkpoint < d <= date):
+            catalogue = apply_delta(catalogue, read_snapshot(self._file('delta', delta_date), mmap=False))
+        return catalogue
+
+    def _lookup(self, path, diamond_id):
+        """Return the (start, stop) rows of diamond_id in an events snapshot sorted by id."""
+        if path not in self._ids:
+            self._ids[path] = DictionaryColumn.load(path, 'id')
+        ids = self._ids[path]
+        # binary search over the distinct ids, stored in sorted order
+        lo, hi = 0, len(ids.offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ids.decode([mid])[0] < diamond_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(ids.offsets) - 1 or ids.decode([lo])[0] != diamond_id:
+            return 0, 0
+        return (int(np.searchsorted(ids.codes, lo, 'left')),
+                int(np.searchsorted(ids.codes, lo, 'right')))
+
+    def price_history(self, diamond_id):
+        """
+            Return: pandas dataframe of date, price, change for one diamond, oldest first
+        """
+        found = []
+        for path in self._event_files():
+            start, stop = self._lookup(path, diamond_id)
+            if start < stop:
+                found.append(read_snapshot(path, ['date', 'price', 'change']).iloc[start:stop])
+        if not found:
+            return pd.DataFrame({'date': [], 'price': [], 'change': []})
+        # files are in date order, so are their rows
+        return pd.concat(found, ignore_index=True)
+
+    def prune(self):
+        """
+            Remove files not listed in the manifest, e.g. after an interrupted record
+        """
+        listed = {os.path.basename(self._file('base', d)) for d in self.manifest['checkpoints']} | \
+                 {os.path.basename(self._file('delta', d)) for d in self.manifest['deltas']} | \
+                 {os.path.basename(path) for path in self._event_files()} | {MANIFEST_FILE}
+        for name in os.listdir(self.path):
+            if name not in listed:
+                full_path = os.path.join(self.path, name)
+                if os.path.isdir(full_path):
+                    shutil.rmtree(full_path)
+                else:
+                    os.remove(full_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query the diamonds price history.')
+    parser.add_argument('--history-dir', default=HISTORY_DIR)
+    parser.add_argument('--id', help='print the price history of one diamond')
+    parser.add_argument('--as-of', help='rebuild the catalogue of a date, YYYYMMDD')
+    parser.add_argument('--output', help='csv file for --as-of')
+    args = parser.parse_args(argv)
+
+    history = History(args.history_dir)
+    if args.id:
+        print(history.price_history(args.id).to_string(index=False))
+    if args.as_of:
+        catalogue = history.as_of(args.as_of)
+        if args.output:
+            catalogue.to_csv(args.output, index=False)
+        print("Catalogue as of {}: {} diamonds.".format(args.as_of, len(catalogue)))
+
+
+if __name__ == '__main__':
+    main()
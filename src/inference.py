@@ -1,62 +1,53 @@
-import os
 import numpy as np
-import pandas as pd
-from pickle import load
-from .constants import (MODEL_PATH, MODEL_WEIGHT_PATH, MODEL_SCALER_PATH, 
-                        ranking, fluorescence)
 
-import tensorflow as tf
-from sklearn.preprocessing import MinMaxScaler, PolynomialFeatures, OneHotEncoder
+from .constants import ranking
+from .registry import registry_for
+from .instrument import stage
 
+# raw columns read by prepare_input, a change in any of them changes the prediction
+FEATURE_COLS = ['measurements', 'carat', 'depth', 'lxwRatio', 'table', 'sellingIndex',
+                'hasVisualization', 'fluorescence'] + list(ranking.keys())
 
-def prepare_input(df):
+
+def prepare_input(df, shape=None):
     """
         Input:
             df: pandas dataframe
+            shape: (string) shape code of the diamonds, selects the model, see registry_for
         Output:
             x_num: (numpy array) numerical input features
     """
-    # split measurements
-    measurements = df['measurements'].str.replace(' mm', '').str.split(' x ', expand=True)
-    measurements = measurements.apply(pd.to_numeric)
-    measurements.columns = ['length', 'width', 'height']
-    df = df.join(measurements)
-    
-    # ordinal encoding (can't use pd.Categorical, in case missing certain categories)
-    for key, value in ranking.items():
-        value_map = {k: v for v, k in enumerate(value)}
-        df['ord_{}'.format(key)] = df[key].map(value_map)
-    
-    # add categorical features 
-    # onehot encoding Fluorescence (no straightforward ordering)
-    enc = OneHotEncoder(categories=[fluorescence], sparse=False)
-    x_fluors = enc.fit_transform(df['fluorescence'].values.reshape(-1, 1))
-    
-    x_visual = df['hasVisualization'].astype(int).values.reshape(-1, 1)
-    
-    # select columns used in model
-    cols_num = ['carat', 'depth', 'lxwRatio', 'table', 'sellingIndex', 'length', 'width', 'height']
-    cols_ord = ['ord_{}'.format(key) for key in ranking.keys()]
-    
-    # polynomials (degree 2) for numerical+ordinal turn out to be useful
-    poly_features = PolynomialFeatures(degree=2, include_bias=False)
-    x_poly = poly_features.fit_transform(df[cols_num + cols_ord].values)
-    
-    # apply MinMax scale to only numerical+ordinal features
-    scaler = load(open(MODEL_SCALER_PATH, 'rb'))
-    
-    # transform x
-    x_minmax = scaler.transform(x_poly)
-    
-    x = np.hstack((x_minmax, x_fluors, x_visual))
-    x = x.astype("float32")
-    
-    return x
+    # encoders and scaler are fitted once and kept by the registry, see src.features
+    _, transformer = registry_for(shape).get()
+    with stage('prepare_input', rows=len(df)):
+        return transformer.transform(df)
 
-def predict(x):
+def predict(x, batch_size=None, shape=None):
+    """
+        Return: (numpy array) predicted price of each row, NaN for rows with a
+                missing or unknown feature (e.g. a cut outside src.constants.ranking)
+    """
     # preprocess data
-    x_process = prepare_input(x)
-    # load the model
-    model = tf.keras.models.load_model(MODEL_PATH)
-    model.load_weights(MODEL_WEIGHT_PATH)
-    return model.predict(x_process).flatten()
\ No newline at end of file
+    x_process = prepare_input(x, shape)
+    # model is loaded once per process by the registry
+    model, _ = registry_for(shape).get()
+    valid = ~np.isnan(x_process).any(axis=1)
+    with stage('predict', rows=int(valid.sum())):
+        if valid.all():
+            return model.predict(x_process, batch_size=batch_size).flatten()
+        out = np.full(len(x_process), np.nan, dtype=np.float32)
+        if valid.any():
+            out[valid] = model.predict(x_process[valid], batch_size=batch_size).flatten()
+        return out
+
+
+def drop_unpriced(df):
+    """
+        Return: df without the rows the model could not price, predicted_price as int
+    """
+    unpriced = df['predicted_price'].isna()
+    if unpriced.any():
+        print("Dropped {} diamonds with missing or unknown features, no predicted price.".format(
+            int(unpriced.sum())))
+        df = df[~unpriced]
+    return df.assign(predicted_price=df['predicted_price'].astype(int))
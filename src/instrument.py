@@ -0,0 +1,156 @@
+"""
+    Per-stage timing and memory instrumentation
+
+    Off by default. Set DIAMONDS_PROFILE=1 to time the stages wrapped in
+    `with stage(name):` and record their resident memory delta, or
+    DIAMONDS_PROFILE=memory to also trace python allocations with
+    tracemalloc (slower, gives the peak allocated inside each stage).
+
+    Every finished stage is logged as one json record on the
+    'diamonds.profile' logger and appended to the records of the current
+    thread, which the app shows in a debug panel after each rerun. When
+    disabled, stage() returns a shared no-op context manager.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import tracemalloc
+from collections import deque
+
+PROFILE_ENV = 'DIAMONDS_PROFILE'
+MODE = os.environ.get(PROFILE_ENV, '').strip().lower()
+ENABLED = MODE not in ('', '0', 'false', 'off')
+TRACE_MEMORY = MODE == 'memory'
+# records kept per thread, threads that never call start_run() stay bounded
+MAX_RECORDS = 200
+
+logger = logging.getLogger('diamonds.profile')
+_local = threading.local()
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _rss():
+    """Return the resident memory of the process in bytes, None where /proc is missing."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _mb(n_bytes):
+    return None if n_bytes is None else round(n_bytes / 2 ** 20, 2)
+
+
+class _NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        stack = _stack()
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        self.rss = _rss()
+        if TRACE_MEMORY:
+            self.traced = tracemalloc.get_traced_memory()[0]
+            self.peak = self.traced
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _stack().pop()
+        rss = _rss()
+        record = dict(stage=self.name, seconds=round(seconds, 6),
+                      rss_mb=_mb(rss), rss_delta_mb=_mb(None if rss is None or self.rss is None
+                                                        else rss - self.rss))
+        if TRACE_MEMORY:
+            # the peak of a nested stage was reset by its children, take the max over them
+            peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            record['traced_peak_mb'] = _mb(peak - self.traced)
+            if self.parent is not None:
+                self.parent.peak = max(self.parent.peak, peak)
+                tracemalloc.reset_peak()
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        record.update(self.fields)
+        record['depth'] = len(_stack())
+        _records().append(record)
+        logger.info(json.dumps(record, default=str))
+        return False
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def _records():
+    if not hasattr(_local, 'records'):
+        _local.records = deque(maxlen=MAX_RECORDS)
+    return _local.records
+
+
+def stage(name, **fields):
+    """
+        Context manager timing the code it wraps as stage `name`
+        fields: extra values logged with the record, e.g. rows=len(df)
+    """
+    if not ENABLED:
+        return _NULL_STAGE
+    return _Stage(name, fields)
+
+
+def start_run():
+    """
+        Forget the records of the previous run of this thread, call at the top of a rerun
+    """
+    if ENABLED:
+        _local.records = deque(maxlen=MAX_RECORDS)
+
+
+def last_run():
+    """
+        Return: (list) records of the stages finished by this thread since start_run()
+    """
+    return list(_records()) if ENABLED else []
+
+
+def enable(trace_memory=False):
+    """
+        Turn instrumentation on at runtime, e.g. from a benchmark or a shell
+    """
+    global ENABLED, TRACE_MEMORY
+    ENABLED = True
+    TRACE_MEMORY = trace_memory
+    _setup()
+
+
+def _setup():
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+        logger.setLevel(logging.INFO)
+    if TRACE_MEMORY and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+if ENABLED:
+    _setup()
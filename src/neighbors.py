@@ -0,0 +1,84 @@
+"""
+    Nearest comparable diamonds
+
+    A KD-tree over the MinMax scaled numerical and ordinal features the
+    model reads (carat, depth, lxwRatio, table, sellingIndex, measurements
+    and the ranking columns), so 'comparable' means close in the space the
+    model sees. The tree is built once per snapshot; a page of cards is
+    answered with one batched query.
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .features import NUM_COLS
+
+N_COMPARABLES = 3
+
+
+class ComparableIndex:
+    """
+        df: pandas dataframe, the catalogue, with every column prepare_input reads
+        transformer: FeatureTransformer, its scaler gives the feature space
+    """
+
+    def __init__(self, df, transformer):
+        n_base = len(NUM_COLS) + len(transformer.ranking)
+        # the linear terms come first in the scaler, see FeatureTransformer.terms
+        points = transformer.base_features(df)
+        points *= transformer.scale[:n_base]
+        points += transformer.offset[:n_base]
+        valid = ~np.isnan(points).any(axis=1)
+        self.points = points
+        self.rows = np.flatnonzero(valid)
+        self.prices = np.asarray(df['price'].values)
+        self.tree = cKDTree(points[valid], leafsize=32, balanced_tree=False)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def query(self, rows, k=N_COMPARABLES):
+        """
+            Input:
+                rows: (array of int) catalogue positions of the diamonds to compare
+                k: (int) comparables per diamond, the diamond itself is left out
+            Output:
+                (numpy arrays) catalogue positions and distances, shape (len(rows), k),
+                -1 and inf where there is no comparable
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        neighbors = np.full((len(rows), k), -1, dtype=np.int64)
+        distances = np.full((len(rows), k), np.inf)
+        queried = ~np.isnan(self.points[rows]).any(axis=1)
+        if not queried.any() or not len(self.rows):
+            return neighbors, distances
+        k_query = min(k + 1, len(self.rows))
+        dist, idx = self.tree.query(self.points[rows[queried]], k=k_query, workers=-1)
+        dist, idx = dist.reshape(len(idx), k_query), idx.reshape(len(idx), k_query)
+        found = self.rows[idx]
+        for out, row, found_row, dist_row in zip(np.flatnonzero(queried), rows[queried], found, dist):
+            keep = found_row != row
+            n_keep = min(k, keep.sum())
+            neighbors[out, :n_keep] = found_row[keep][:n_keep]
+            distances[out, :n_keep] = dist_row[keep][:n_keep]
+        return neighbors, distances
+
+    def comparable_prices(self, rows, k=N_COMPARABLES):
+        """
+            Return: (list) one list of comparable prices per row, closest first
+        """
+        neighbors, _ = self.query(rows, k)
+        return [[int(self.prices[i]) for i in row if i >= 0] for row in neighbors]
+
+
+def build_index(frame, transformer, strings=None):
+    """
+        Build the index of a catalogue whose string columns may be dictionary encoded
+        strings: (dict) column name -> DictionaryColumn, see src.shared.Catalogue
+    """
+    if 'measurements' not in frame and strings and 'measurements' in strings:
+        column = strings['measurements']
+        # decode each distinct value once, rows only index them
+        distinct = np.append(column.decode(np.arange(len(column.offsets) - 1)), None)
+        codes = np.where(column.codes >= 0, column.codes, len(distinct) - 1)
+        frame = frame.assign(measurements=distinct[codes])
+    return ComparableIndex(frame, transformer)
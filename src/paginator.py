@@ -3,6 +3,7 @@
 """
 import streamlit as st
 import numpy as np
+import pandas as pd
 
 def paginator(label, items, items_per_page=10, on_sidebar=True):
     """Lets the user paginate a set of items.
@@ -10,8 +11,10 @@ def paginator(label, items, items_per_page=10, on_sidebar=True):
     ----------
     label : str
         The label to display over the pagination widget.
-    items : Iterator[Any]
-        The items to display in the paginator.
+    items : Sequence[Any] or pandas.DataFrame
+        The items to display in the paginator. Only the page shown is
+        fetched, with a single slice (iloc for dataframes). Plain iterators
+        are still accepted but have to be read in full.
     items_per_page: int
         The number of items to display per page.
     on_sidebar: bool
@@ -21,7 +24,7 @@ def paginator(label, items, items_per_page=10, on_sidebar=True):
     -------
     Iterator[Tuple[int, Any]]
         An iterator over *only the items on that page*, including
-        the item's index.
+        the item's index. Dataframe items are rows (pandas Series).
     Example
     -------
     This shows how to display a few pages of fruit.
@@ -37,6 +40,49 @@ def paginator(label, items, items_per_page=10, on_sidebar=True):
     ...     st.write('%s. **%s**' % (i, fruit))
     """
 
+    items = _as_sequence(items)
+    min_index, max_index = select_page(label, len(items), items_per_page, on_sidebar)
+    page = items[min_index:max_index]
+    if isinstance(page, pd.DataFrame):
+        page = (row for _, row in page.iterrows())
+    return zip(range(min_index, max_index), page)
+
+
+class _FrameRows:
+    """Positional slicing over the rows of a dataframe."""
+    def __init__(self, df):
+        self.df = df
+
+    def __len__(self):
+        return len(self.df)
+
+    def __getitem__(self, key):
+        return self.df.iloc[key]
+
+
+def _as_sequence(items):
+    if isinstance(items, pd.DataFrame):
+        return _FrameRows(items)
+    if hasattr(items, '__len__') and hasattr(items, '__getitem__'):
+        return items
+    # plain iterators have to be materialized to be counted
+    return list(items)
+
+
+def page_bounds(n_items, page_number, items_per_page):
+    """
+        Return: (tuple) [start, stop) positions of a page
+    """
+    start = min(page_number * items_per_page, n_items)
+    return start, min(start + items_per_page, n_items)
+
+
+def select_page(label, n_items, items_per_page=10, on_sidebar=True):
+    """Display the page selectbox and return the [start, stop) positions of the chosen page.
+
+    Only the positions are returned, the caller fetches the rows of the page,
+    e.g. with Selection.page.
+    """
     # Figure out where to display the paginator
     if on_sidebar:
         location = st.sidebar.empty()
@@ -44,14 +90,43 @@ def paginator(label, items, items_per_page=10, on_sidebar=True):
         location = st.empty()
 
     # Display a pagination selectbox in the specified location.
-    items = list(items)
-    n_pages = len(items)
-    n_pages = (len(items) - 1) // items_per_page + 1
+    n_pages = max((n_items - 1) // items_per_page + 1, 1)
     page_format_func = lambda i: "Page %s" % (i+1)
     page_number = location.selectbox(label, range(n_pages), format_func=page_format_func)
+    return page_bounds(n_items, page_number, items_per_page)
+
 
-    # Iterate over the items in the page to let the user display them.
-    min_index = page_number * items_per_page
-    max_index = min_index + items_per_page
-    import itertools
-    return itertools.islice(enumerate(items), min_index, max_index)
+def cursor_page(keys, cursor=None, direction='next', items_per_page=10):
+    """Page through sorted keys relative to a cursor key instead of a page number.
+    Parameters
+    ----------
+    keys : array-like
+        Unique keys in ascending order, e.g. a sorted numpy array.
+    cursor : Any
+        Key returned as prev/next cursor by the previous call, None for the first page.
+    direction : str
+        'next' for the page after the cursor, 'prev' for the page before it.
+    items_per_page: int
+        The number of items on a page.
+
+    Returns
+    -------
+    Tuple[int, int, Any, Any]
+        [start, stop) positions of the page, then the prev and next cursors
+        (None when there is no page in that direction).
+    """
+    n_items = len(keys)
+    if cursor is None:
+        start = 0
+        stop = min(items_per_page, n_items)
+    elif direction == 'next':
+        start = int(np.searchsorted(keys, cursor, 'right'))
+        stop = min(start + items_per_page, n_items)
+    elif direction == 'prev':
+        stop = int(np.searchsorted(keys, cursor, 'left'))
+        start = max(stop - items_per_page, 0)
+    else:
+        raise ValueError("direction must be 'next' or 'prev', got {}".format(direction))
+    prev_cursor = keys[start] if start > 0 else None
+    next_cursor = keys[stop - 1] if stop < n_items else None
+    return start, stop, prev_cursor, next_cursor
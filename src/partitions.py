@@ -0,0 +1,152 @@
+"""
+    Catalogue partitioned by shape and price band
+
+    A partitioned catalogue is a directory of snapshots, one per shape and
+    price band, plus a manifest:
+
+        catalogue_20200101/
+            partitions.json
+            shape=RD/band=10000-20000.snap
+            shape=RD/band=20000-30000.snap
+            shape=PR/band=10000-20000.snap
+            ...
+
+    The manifest lists every partition with its shape, band and number of
+    rows, so a reader only opens the partitions that can match its shape and
+    price filters. Crawled pages are routed to one SnapshotWriter per
+    partition, memory stays bounded by a page per partition.
+"""
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+from .snapshot import META_FILE, SNAPSHOT_COLS, SNAPSHOT_EXT, SnapshotWriter, read_snapshot
+
+MANIFEST_FILE = 'partitions.json'
+# upper edge excluded, the last band is open ended
+PRICE_BANDS = [0, 2000, 5000, 10000, 20000, 30000, 50000, 100000]
+PARTITION_COLS = SNAPSHOT_COLS + ['shape']
+
+
+def band_bounds(bands, i):
+    """
+        Return: (tuple) (lo, hi) of band i, hi is None for the last band
+    """
+    return bands[i], bands[i + 1] if i + 1 < len(bands) else None
+
+
+def partition_name(shape, band):
+    lo, hi = band
+    return os.path.join('shape={}'.format(shape),
+                        'band={}-{}{}'.format(lo, '' if hi is None else hi, SNAPSHOT_EXT))
+
+
+def _band_overlaps(partition, min_price, max_price):
+    lo, hi = partition['band']
+    return (max_price is None or lo <= max_price) and \
+           (min_price is None or hi is None or hi > min_price)
+
+
+class PartitionedWriter:
+    """
+        Page sink writing a partitioned catalogue
+
+        path: (string) catalogue directory, built next to it and renamed on close
+        bands: (list) price band edges
+    """
+
+    def __init__(self, path, bands=PRICE_BANDS, columns=PARTITION_COLS):
+        self.path = path
+        self.bands = bands
+        self.columns = columns
+        self.tmp_path = path + '.tmp'
+        if os.path.exists(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.makedirs(self.tmp_path)
+        self.writers = {}
+
+    def append(self, page, shape=None):
+        """
+            Route the rows of a normalized page to their partitions
+            shape: (string) shape of every row, taken from a 'shape' column otherwise
+        """
+        if shape is not None:
+            page = page.assign(shape=shape)
+        band_index = np.maximum(np.searchsorted(self.bands, page['price'].values, 'right') - 1, 0)
+        for (shape, i), rows in page.groupby([page['shape'].values, band_index], sort=False):
+            band = band_bounds(self.bands, int(i))
+            key = (shape, band)
+            if key not in self.writers:
+                partition_path = os.path.join(self.tmp_path, partition_name(shape, band))
+                os.makedirs(os.path.dirname(partition_path), exist_ok=True)
+                self.writers[key] = SnapshotWriter(partition_path, self.columns)
+            self.writers[key].append(rows)
+
+    def sink(self, shape):
+        """
+            Return: function(page) appending pages of one shape, see Diamonds(page_sink=...)
+        """
+        return lambda page: self.append(page, shape)
+
+    def close(self, unique='id'):
+        partitions = []
+        for (shape, band), writer in sorted(self.writers.items(), key=lambda item: (item[0][0], item[0][1][0])):
+            writer.close(unique)
+            with open(os.path.join(writer.path, META_FILE)) as f:
+                n_rows = json.load(f)['n_rows']
+            partitions.append({'shape': shape, 'band': list(band), 'n_rows': n_rows,
+                               'path': partition_name(shape, band)})
+        with open(os.path.join(self.tmp_path, MANIFEST_FILE), 'w') as f:
+            json.dump({'bands': self.bands, 'partitions': partitions}, f)
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.replace(self.tmp_path, self.path)
+        print("Complete: write {} partitions to {}.".format(len(partitions), self.path))
+
+
+def is_partitioned(path):
+    return os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+
+def list_partitions(path, shapes=None, min_price=None, max_price=None):
+    """
+        Return: (list) manifest entries of the partitions that can hold matching rows,
+                with 'path' made absolute
+    """
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    return [dict(p, path=os.path.join(path, p['path'])) for p in manifest['partitions']
+            if (shapes is None or p['shape'] in shapes) and _band_overlaps(p, min_price, max_price)]
+
+
+def shapes_of(path):
+    """
+        Return: (list) shapes present in a partitioned catalogue
+    """
+    return sorted({p['shape'] for p in list_partitions(path)})
+
+
+def iter_partitions(path, shapes=None, min_price=None, max_price=None, columns=None):
+    """
+        Yield (manifest entry, dataframe) for each partition matching the filters
+    """
+    for partition in list_partitions(path, shapes, min_price, max_price):
+        yield partition, read_snapshot(partition['path'], columns)
+
+
+def read_partitioned(path, shapes=None, min_price=None, max_price=None, columns=None):
+    """
+        Return: pandas dataframe of the partitions matching shapes and [min_price, max_price],
+                rows outside the price range are dropped
+    """
+    frames = [df for _, df in iter_partitions(path, shapes, min_price, max_price, columns)]
+    if not frames:
+        return pd.DataFrame({col: [] for col in columns or PARTITION_COLS})
+    df = pd.concat(frames, ignore_index=True)
+    if 'price' in df and (min_price is not None or max_price is not None):
+        lo = -float('inf') if min_price is None else min_price
+        hi = float('inf') if max_price is None else max_price
+        df = df[df['price'].between(lo, hi)].reset_index(drop=True)
+    return df
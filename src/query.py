@@ -0,0 +1,234 @@
+"""
+    Query engine for the sidebar filters
+
+    Everything that does not depend on the widget values is computed once
+    per catalogue:
+        - a TopK ranker for each sort column (descending), which only orders
+          as many rows as the pages asked so far
+        - the row order and sorted values for each range column, so a
+          [lo, hi] filter is two binary searches
+        - integer codes for each categorical column, so an isin filter is a
+          lookup in a table with one entry per category
+    A query then only touches the rows inside the narrowest range filter,
+    and a page only touches the rows needed to fill it.
+"""
+import threading
+import numpy as np
+import pandas as pd
+
+
+class TopK:
+    """
+        Rows ranked by one column, descending, ties in row order, revealed a
+        block at a time
+
+        The first k rows cost one partition pass over the rows not revealed
+        yet plus a sort of k rows, O(n + k log k), instead of sorting all n
+        rows up front. Asking for more rows reveals the next block the same
+        way; blocks at least double, so paging to the end costs about one
+        full sort. Safe to share between threads.
+
+        values: (numpy array) ranking value of each row, NaN ranks last
+        rows: (numpy array) row ids, also the tie breaker, arange(len(values)) by default
+    """
+    # above this share of the rows left, sorting them all is cheaper than partitioning
+    SORT_RATIO = 1 / 4
+    MIN_BLOCK = 256
+
+    def __init__(self, values, rows=None):
+        values = np.asarray(values)
+        rows = np.arange(len(values)) if rows is None else np.asarray(rows)
+        self.n = len(rows)
+        if values.dtype.kind == 'f':
+            nan = np.isnan(values)
+            self._nan_rows = np.sort(rows[nan])
+            rows, values = rows[~nan], values[~nan]
+        else:
+            self._nan_rows = rows[:0]
+        # rows not revealed yet and their values
+        self._rows = rows
+        self._values = values
+        self.ordered = rows[:0]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.n
+
+    def _reveal(self, k):
+        rows, values = self._rows, self._values
+        if k >= len(rows) * self.SORT_RATIO:
+            block = np.concatenate((rows[np.lexsort((rows, -values))], self._nan_rows))
+            self._rows, self._values, self._nan_rows = rows[:0], values[:0], rows[:0]
+        else:
+            # k-th largest value: every row above it is in the block, ties fill it up in row order
+            threshold = np.partition(values, len(values) - k)[len(values) - k]
+            taken = values > threshold
+            tied = np.flatnonzero(values == threshold)
+            n_tied = k - np.count_nonzero(taken)
+            if n_tied < len(tied):
+                tied = tied[np.argpartition(rows[tied], n_tied - 1)[:n_tied]]
+            taken[tied] = True
+            block = rows[taken]
+            block = block[np.lexsort((block, -values[taken]))]
+            self._rows, self._values = rows[~taken], values[~taken]
+        self.ordered = np.concatenate((self.ordered, block))
+
+    def head(self, k):
+        """
+            Return: (numpy array) the first min(k, n) row ids in rank order
+        """
+        with self._lock:
+            if k > len(self.ordered) and len(self.ordered) < self.n:
+                self._reveal(max(k - len(self.ordered), len(self.ordered), self.MIN_BLOCK))
+            return self.ordered[:k]
+
+
+class QueryEngine:
+    """
+        df: pandas dataframe, the catalogue
+        sort_cols: (list) columns results can be sorted by, descending
+        range_cols: (list) numeric columns filtered by [lo, hi]
+        category_cols: (list) columns filtered by a set of allowed values
+        strings: (dict) column name -> DictionaryColumn, string columns kept
+                 encoded and only decoded for the rows returned
+    """
+
+    def __init__(self, df, sort_cols, range_cols=('carat', 'price'),
+                 category_cols=('color', 'clarity', 'fluorescence'), strings=None):
+        if not df.index.equals(pd.RangeIndex(len(df))):
+            df = df.reset_index(drop=True)
+        self.df = df
+        self.strings = strings or {}
+        self.n = len(self.df)
+        # descending, ties keep catalogue order, rows are only ordered as pages need them
+        self.rankers = {col: TopK(self.df[col].values) for col in sort_cols}
+        self.range_index = {}
+        for col in range_cols:
+            order = np.argsort(self.df[col].values, kind='stable')
+            self.range_index[col] = (self.df[col].values[order], order)
+        self.category_index = {}
+        for col in category_cols:
+            series = self.df[col]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # codes shared with the snapshot and the features, nothing to factorize
+                codes, uniques = series.cat.codes.values, series.cat.categories
+            else:
+                codes, uniques = pd.factorize(series)
+            self.category_index[col] = (codes, pd.Index(uniques))
+
+    def take(self, rows, strings=True):
+        """
+            Return: pandas dataframe of the given row positions
+            strings: (bool) also decode the dictionary encoded string columns
+        """
+        df = self.df.iloc[rows]
+        if strings and self.strings:
+            df = df.copy()
+            for name, column in self.strings.items():
+                df[name] = column.take(rows)
+        return df
+
+    def _range_bounds(self, col, lo, hi):
+        values, _ = self.range_index[col]
+        return np.searchsorted(values, lo, 'left'), np.searchsorted(values, hi, 'right')
+
+    def select(self, ranges=None, isin=None):
+        """
+            Input:
+                ranges: (dict) column -> (lo, hi), both inclusive
+                isin: (dict) column -> allowed values
+            Output:
+                Selection over the matching rows
+        """
+        ranges = ranges or {}
+        isin = isin or {}
+        if ranges:
+            # start from the range filter with the fewest rows
+            bounds = {col: self._range_bounds(col, lo, hi) for col, (lo, hi) in ranges.items()}
+            driver = min(ranges, key=lambda col: bounds[col][1] - bounds[col][0])
+            start, stop = bounds[driver]
+            rows = self.range_index[driver][1][start:stop]
+        else:
+            driver = None
+            rows = np.arange(self.n)
+        for col, (lo, hi) in ranges.items():
+            if col != driver:
+                values = self.df[col].values[rows]
+                rows = rows[(values >= lo) & (values <= hi)]
+        for col, allowed in isin.items():
+            codes, uniques = self.category_index[col]
+            lookup = np.append(uniques.isin(list(allowed)), False)  # code -1 is NaN
+            rows = rows[lookup[codes[rows]]]
+        return Selection(self, rows)
+
+
+class Selection:
+    """
+        Rows matching a query, ordered lazily by one of the sort columns
+
+        Small selections are ranked with their own TopK. Large ones walk the
+        ranker of the whole catalogue and stop as soon as the page is full.
+    """
+    # below this share of the catalogue, ranking the selection is cheaper than scanning
+    SORT_RATIO = 1 / 8
+    SCAN_CHUNK = 4096
+
+    def __init__(self, engine, rows):
+        self.engine = engine
+        self.rows = rows
+        self._ordered = {}
+        self._rankers = {}
+        self._mask = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _ordered_rows(self, sort_col, stop):
+        """
+            Return: (numpy array) at least the first `stop` selected rows in sort order
+        """
+        engine = self.engine
+        if len(self.rows) <= engine.n * self.SORT_RATIO:
+            if sort_col not in self._rankers:
+                self._rankers[sort_col] = TopK(engine.df[sort_col].values[self.rows], self.rows)
+            return self._rankers[sort_col].head(stop)
+        if sort_col in self._ordered:
+            ordered, scanned = self._ordered[sort_col]
+        else:
+            ordered, scanned = np.empty(0, dtype=np.intp), 0
+        if len(ordered) >= stop or scanned >= engine.n:
+            return ordered
+        if self._mask is None:
+            self._mask = np.zeros(engine.n, dtype=bool)
+            self._mask[self.rows] = True
+        ranker = engine.rankers[sort_col]
+        parts = [ordered]
+        found = len(ordered)
+        while found < stop and scanned < engine.n:
+            chunk = ranker.head(scanned + max(self.SCAN_CHUNK, stop - found))[scanned:]
+            hits = chunk[self._mask[chunk]]
+            parts.append(hits)
+            found += len(hits)
+            scanned += len(chunk)
+        ordered = np.concatenate(parts)
+        self._ordered[sort_col] = (ordered, scanned)
+        return ordered
+
+    def page(self, sort_col, start, stop):
+        """
+            Return: pandas dataframe of the selected rows [start, stop) in sort order
+        """
+        rows = self._ordered_rows(sort_col, stop)[start:stop]
+        return self.engine.take(rows)
+
+    def frame(self, sort_col=None, strings=True):
+        """
+            Return: pandas dataframe of all selected rows, sorted if sort_col is given
+            strings: (bool) also decode the dictionary encoded string columns
+        """
+        if sort_col is None:
+            rows = np.sort(self.rows)
+        else:
+            rows = self._ordered_rows(sort_col, len(self.rows))
+        return self.engine.take(rows, strings)
+
@@ -0,0 +1,239 @@
+"""
+    Background refresh of the scored catalogue
+
+    The crawl, clean and scoring steps run outside of user requests, either
+    in a thread of the app process (start_background_refresh) or as a
+    separate worker (python -m src.refresh). The scored catalogue is written
+    to a new snapshot directory, then a small CURRENT marker is atomically
+    replaced to point at it. Running sessions read the marker on every rerun
+    and switch to the new snapshot on their next rerun.
+
+    With shapes, the crawl is partitioned by shape and price band (see
+    src.partitions) and each shape is scored by its own model into its own
+    snapshot, listed under 'shapes' in the marker.
+"""
+import os
+import glob
+import fcntl
+import json
+import time
+import shutil
+import argparse
+import threading
+from datetime import datetime
+
+from .categories import normalize
+from .constants import DATA_DIR, PREDICTION_STORE_PATH, SHAPES, PRICE_RANGE
+from .fetch_data import update_data, update_catalogue
+from .instrument import stage
+from .partitions import read_partitioned, shapes_of
+from .snapshot import SNAPSHOT_COLS, SNAPSHOT_EXT, load_catalogue, write_snapshot
+
+MARKER_FILE = 'CURRENT'
+# flock'ed while refreshing, the kernel releases it if the process dies
+LOCK_FILE = 'refresh.lock'
+SCORED_COLS = SNAPSHOT_COLS + ['predicted_price', 'estimate_difference']
+
+
+def read_marker(data_dir=DATA_DIR):
+    """
+        Return: (dict) path, date, status and model_version of the current scored snapshot,
+                plus 'shapes' {shape: {path, model_version}} for a multi-shape catalogue,
+                None before the first refresh
+    """
+    try:
+        with open(os.path.join(data_dir, MARKER_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_marker(data_dir, marker):
+    tmp_path = os.path.join(data_dir, MARKER_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(marker, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(data_dir, MARKER_FILE))
+
+
+def _acquire_lock(data_dir):
+    """
+        Make sure only one process (or thread) refreshes a data directory at a time
+        Return: open lock file, held until _release_lock, None if another refresh holds it
+    """
+    f = open(os.path.join(data_dir, LOCK_FILE), 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+def _release_lock(lock):
+    # the file is left in place, removing it could drop a lock another process just took
+    fcntl.flock(lock, fcntl.LOCK_UN)
+    lock.close()
+
+
+def _store_path(shape):
+    if shape is None:
+        return PREDICTION_STORE_PATH
+    root, ext = os.path.splitext(PREDICTION_STORE_PATH)
+    return '{}_{}{}'.format(root, shape, ext)
+
+
+def score_catalogue(df, shape=None):
+    """
+        Clean a raw catalogue and add predicted_price and estimate_difference
+        shape: (string) shape of the diamonds in df, selects the model, see registry_for
+        Return: (pandas dataframe sorted by estimate_difference descending, model version)
+    """
+    # imported here so that reading snapshots does not load the model
+    from .inference import predict, drop_unpriced
+    from .registry import registry_for
+    from .store import PredictionStore
+
+    df = df.drop_duplicates()
+    # keep only diamonds with images
+    df = df.dropna(subset=['visualizationImageUrl'])
+    # fixed graded categoricals, fluorescence reduced to its canonical grades,
+    # the model has no input for an unknown fluorescence
+    df = normalize(df, strict=['fluorescence'])
+    # predict diamonds price using trained model, only new or changed diamonds hit the model
+    model_version = registry_for(shape).warm()
+    store = PredictionStore(_store_path(shape), model_version)
+    df['predicted_price'] = store.score(df, lambda rows: predict(rows, shape=shape))
+    store.prune(df['id'])
+    store.save()
+    # unpriced diamonds would rank first as -2**63 predictions, they are left out
+    df = drop_unpriced(df)
+    # compute difference and sort in descending order by (predicted_price - actual_price)
+    df['estimate_difference'] = df['predicted_price'] - df['price']
+    df = df.sort_values(by=['estimate_difference'], ascending=False, ignore_index=True)
+    return df, model_version
+
+
+def _refresh_shapes(data_dir, parallel, shapes, stamp, price_range=None):
+    """Crawl the partitioned catalogue and write one scored snapshot per shape."""
+    with stage('update_catalogue'):
+        raw_path, status = update_catalogue(data_dir, shapes, parallel=parallel)
+    min_price, max_price = price_range or (None, None)
+    marker = {'date': raw_path.rsplit('_', 1)[1], 'status': status, 'shapes': {}}
+    for shape in shapes_of(raw_path):
+        # only the partitions of this shape whose price band overlaps the served range are read
+        with stage('score_catalogue', shape=shape):
+            scored, model_version = score_catalogue(
+                read_partitioned(raw_path, [shape], min_price, max_price, columns=SNAPSHOT_COLS), shape)
+        path = os.path.join(data_dir, 'scored_{}_{}{}'.format(stamp, shape, SNAPSHOT_EXT))
+        with stage('write_snapshot', rows=len(scored), shape=shape):
+            write_snapshot(scored, path, columns=SCORED_COLS)
+        marker['shapes'][shape] = {'path': path, 'model_version': model_version}
+    # top level path is the round diamonds when crawled, for readers of a single catalogue
+    default = marker['shapes'].get('RD') or next(iter(marker['shapes'].values()))
+    marker.update(path=default['path'], model_version=default['model_version'])
+    return marker
+
+
+def _stamp(path):
+    return os.path.basename(path).split('_')[1].split('.')[0]
+
+
+def refresh(data_dir=DATA_DIR, parallel=False, keep=2, shapes=None, price_range=PRICE_RANGE):
+    """
+        Crawl, clean and score the catalogue, then point the marker at the new snapshot
+        keep: (int) number of refreshes whose scored snapshots are left on disk
+        shapes: (list) shape codes to crawl and score separately, None for the
+                single round diamonds catalogue
+        price_range: (tuple) (min, max) price scored for each shape, None for all
+        Return: (dict) the new marker, None if another process is refreshing
+    """
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    lock = _acquire_lock(data_dir)
+    if lock is None:
+        print("Refresh of {} already running, skipped.".format(data_dir))
+        return None
+    try:
+        # a new name every time, a snapshot is never rewritten while sessions may read it
+        stamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        if shapes:
+            marker = _refresh_shapes(data_dir, parallel, shapes, stamp, price_range)
+        else:
+            with stage('update_data'):
+                raw_path, status = update_data(data_dir, parallel=parallel)
+            raw_date = os.path.basename(raw_path).split('_')[1].split('.')[0]
+            with stage('score_catalogue'):
+                scored, model_version = score_catalogue(load_catalogue(raw_path, SNAPSHOT_COLS))
+            path = os.path.join(data_dir, 'scored_{}{}'.format(stamp, SNAPSHOT_EXT))
+            with stage('write_snapshot', rows=len(scored)):
+                write_snapshot(scored, path, columns=SCORED_COLS)
+            marker = {'path': path, 'date': raw_date, 'status': status, 'model_version': model_version}
+        _write_marker(data_dir, marker)
+
+        # sessions still on the previous snapshot keep it until their next rerun
+        scored_list = glob.glob(os.path.join(data_dir, 'scored_*' + SNAPSHOT_EXT))
+        old_stamps = sorted({_stamp(p) for p in scored_list})[:-keep]
+        for old in scored_list:
+            if _stamp(old) in old_stamps:
+                shutil.rmtree(old, ignore_errors=True)
+        return marker
+    finally:
+        _release_lock(lock)
+
+
+def is_stale(data_dir=DATA_DIR):
+    marker = read_marker(data_dir)
+    return marker is None or marker['date'] != datetime.today().strftime('%Y%m%d')
+
+
+def _refresh_loop(data_dir, interval, parallel, shapes=None, price_range=PRICE_RANGE):
+    while True:
+        if is_stale(data_dir):
+            try:
+                refresh(data_dir, parallel, shapes=shapes, price_range=price_range)
+            except Exception as e:
+                # keep serving the last snapshot, try again on the next tick
+                print("Background refresh failed: {}".format(e))
+        time.sleep(interval)
+
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def start_background_refresh(data_dir=DATA_DIR, interval=600, parallel=False, shapes=None,
+                             price_range=PRICE_RANGE):
+    """
+        Start the refresh thread of this process, once; later calls are no-ops
+    """
+    global _thread
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_refresh_loop,
+                                       args=(data_dir, interval, parallel, shapes, price_range),
+                                       name='diamonds-refresh', daemon=True)
+            _thread.start()
+    return _thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Refresh the scored diamonds catalogue.')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--loop', action='store_true', help='keep running and refresh once a day')
+    parser.add_argument('--interval', type=int, default=600, help='seconds between checks with --loop')
+    parser.add_argument('--parallel', action='store_true', help='fetch price bands concurrently')
+    parser.add_argument('--shapes', nargs='+', default=SHAPES,
+                        help='shape codes crawled into a partitioned catalogue, e.g. RD PR OV')
+    parser.add_argument('--price-range', nargs=2, type=int, default=PRICE_RANGE, metavar=('MIN', 'MAX'),
+                        help='price range scored for each shape, with --shapes')
+    args = parser.parse_args(argv)
+    if args.loop:
+        _refresh_loop(args.data_dir, args.interval, args.parallel, args.shapes, args.price_range)
+    else:
+        refresh(args.data_dir, args.parallel, shapes=args.shapes, price_range=args.price_range)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+    Process-wide model registry
+
+    The model is loaded once per process, lazily on first use, and only
+    reloaded when the files on disk actually change. It runs on the NumPy
+    runtime exported next to the Keras files (see src.runtime); TensorFlow
+    is only imported when the model cannot be exported.
+"""
+import os
+import sys
+import hashlib
+import threading
+from .constants import MODEL_DIR, MODEL_PATH, MODEL_WEIGHT_PATH, MODEL_SCALER_PATH, MODEL_RUNTIME_PATH
+from .features import FeatureTransformer, load_scaler
+from .runtime import DenseModel, KerasModel, export_model, source_hash
+
+
+def _file_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ModelRegistry:
+    """
+        Thread-safe, lazily loaded handle on the price model and its feature pipeline
+
+        Files are checked by mtime on every access (a cheap stat call); the
+        content hash is only recomputed when an mtime moves, so touching a
+        file without changing it does not trigger a reload.
+    """
+
+    def __init__(self, model_path=MODEL_PATH, weight_path=MODEL_WEIGHT_PATH,
+                 scaler_path=MODEL_SCALER_PATH, runtime_path=MODEL_RUNTIME_PATH):
+        self.paths = (model_path, weight_path, scaler_path)
+        self.runtime_path = runtime_path
+        self._lock = threading.Lock()
+        self._mtimes = None
+        self._hashes = None
+        self._model = None
+        self._transformer = None
+        self.version = None
+
+    def _mtimes_on_disk(self):
+        return tuple(os.path.getmtime(p) for p in self.paths)
+
+    def _load_runtime(self, source):
+        """Return the NumPy model, exporting it again if it is missing or stale; None if not possible."""
+        if os.path.exists(self.runtime_path):
+            model = DenseModel.load(self.runtime_path)
+            if model.source == source:
+                return model
+        model_path, weight_path, _ = self.paths
+        try:
+            export_model(model_path, weight_path, self.runtime_path, source)
+        except (ImportError, OSError, ValueError, KeyError) as e:
+            print("Model export failed ({}), using tensorflow.".format(e))
+            return None
+        return DenseModel.load(self.runtime_path)
+
+    def _load(self, hashes):
+        model_path, weight_path, scaler_path = self.paths
+        model = self._load_runtime(source_hash(hashes[:2]))
+        if model is None:
+            model = KerasModel.load(model_path, weight_path)
+        return model, FeatureTransformer(load_scaler(scaler_path))
+
+    def _refresh(self):
+        """Load or reload the model files if needed; caller holds the lock."""
+        mtimes = self._mtimes_on_disk()
+        if self._model is not None and mtimes == self._mtimes:
+            return
+        hashes = tuple(_file_hash(p) for p in self.paths)
+        if self._model is None or hashes != self._hashes:
+            self._model, self._transformer = self._load(hashes)
+            self._hashes = hashes
+            self.version = hashlib.sha1(''.join(hashes).encode()).hexdigest()[:12]
+        self._mtimes = mtimes
+
+    def get(self):
+        """
+            Return (model, feature transformer), loading them on first call
+        """
+        with self._lock:
+            self._refresh()
+            return self._model, self._transformer
+
+    def warm(self):
+        """
+            Load the model eagerly, e.g. at app startup
+            Return: (string) model version
+        """
+        self.get()
+        return self.version
+
+    def set_threads(self, n_threads):
+        """
+            Limit the threads used by the model, call before the first prediction
+        """
+        # the numpy runtime runs on the BLAS thread pool, threadpoolctl comes with scikit-learn
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(n_threads)
+        if 'tensorflow' in sys.modules:
+            tf = sys.modules['tensorflow']
+            tf.config.threading.set_intra_op_parallelism_threads(n_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(n_threads)
+
+    def clear(self):
+        with self._lock:
+            self._model = self._transformer = None
+            self._mtimes = self._hashes = self.version = None
+
+
+# default registry shared by the whole process
+registry = ModelRegistry()
+_shape_registries = {}
+_shape_lock = threading.Lock()
+
+
+def registry_for(shape=None):
+    """
+        Return the registry of the model trained for a shape
+
+        A shape model lives in model/<shape>/ with the same file names as the
+        default model; shapes without their own files share the default registry.
+    """
+    if shape is None:
+        return registry
+    with _shape_lock:
+        if shape not in _shape_registries:
+            paths = [os.path.join(MODEL_DIR, shape, os.path.basename(p))
+                     for p in (MODEL_PATH, MODEL_WEIGHT_PATH, MODEL_SCALER_PATH, MODEL_RUNTIME_PATH)]
+            if all(os.path.exists(p) for p in paths[:3]):
+                _shape_registries[shape] = ModelRegistry(*paths)
+            else:
+                _shape_registries[shape] = registry
+        return _shape_registries[shape]
@@ -0,0 +1,49 @@
+"""
+    Batch rendering of the diamond cards and chart annotations
+
+    Columns of a page are pulled once as python lists and every card is
+    formatted in a single pass, instead of extracting a Series per row.
+"""
+MAIN_COLS = ['carat', 'price', 'id', 'predicted_price',
+             'estimate_difference', 'visualizationImageUrl']
+ATTR_COLS = ['color', 'clarity', 'cut', 'fluorescence']
+DETAILS_URL = 'https://www.bluenile.com/diamond-details/{}'
+
+CARD_FORMAT = ('[![image]({image})]({url}) '
+               'Carat: {x}, Price: ${y}; Suggested: ${pp} '
+               '  \nID: [{id}]({url}) Color **{color}**, Clarity **{clarity}**, '
+               'Cut **{cut}**, Fluorescence **{fluorescence}**')
+ANNOTATION_FORMAT = "<a href='{url}'>${y}(+{ed})</a>"
+COMPARABLES_FORMAT = '  \nComparable diamonds: {}'
+
+
+def _rows(df):
+    """Yield one dict per row holding MAIN_COLS + ATTR_COLS and the details url."""
+    columns = {col: df[col].tolist() for col in MAIN_COLS + ATTR_COLS}
+    for x, y, id, pp, ed, image, color, clarity, cut, fluorescence in zip(
+            *(columns[col] for col in MAIN_COLS + ATTR_COLS)):
+        yield dict(x=x, y=y, id=id, pp=pp, ed=ed, image=image, color=color, clarity=clarity,
+                   cut=cut, fluorescence=fluorescence, url=DETAILS_URL.format(id))
+
+
+def render_cards(df, comparables=None):
+    """
+        Input:
+            df: pandas dataframe, the diamonds of the page
+            comparables: (list) optional, prices of the comparable diamonds of each row
+        Output:
+            (string) markdown for all diamonds in df, one card per paragraph
+    """
+    cards = [CARD_FORMAT.format(**row) for row in _rows(df)]
+    if comparables is not None:
+        cards = [card + COMPARABLES_FORMAT.format(', '.join('${}'.format(p) for p in prices))
+                 if prices else card for card, prices in zip(cards, comparables)]
+    return '\n\n'.join(cards)
+
+
+def render_annotations(df):
+    """
+        Return: (list) plotly annotation dicts linking each diamond in df
+    """
+    return [dict(x=row['x'], y=row['y'], text=ANNOTATION_FORMAT.format(**row))
+            for row in _rows(df)]
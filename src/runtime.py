@@ -0,0 +1,191 @@
+"""
+    NumPy inference runtime for the price model
+
+    The model is a stack of Dense layers, so predicting is a handful of
+    matrix products. The weights are exported once from the Keras files to
+    a plain .npz archive (python -m src.runtime); loading that archive
+    takes milliseconds and needs neither TensorFlow nor h5py.
+
+    The archive records a hash of the Keras files it was exported from, the
+    registry re-exports it (h5py only) when they change, and falls back to
+    TensorFlow (KerasModel) when the model cannot be exported.
+
+    python -m src.runtime --check N compares both on N random inputs.
+"""
+import os
+import json
+import argparse
+import hashlib
+import numpy as np
+
+from .constants import MODEL_PATH, MODEL_WEIGHT_PATH, MODEL_RUNTIME_PATH
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0, out=x),
+}
+
+
+def source_hash(file_hashes):
+    """
+        Return: (string) hash identifying the keras files an archive was exported from
+    """
+    return hashlib.sha1(''.join(file_hashes).encode()).hexdigest()
+
+
+def _layer_configs(model_config):
+    config = model_config['config']
+    # keras 2.2+ nests the layers in a dict, older files store the list directly
+    return config['layers'] if isinstance(config, dict) else config
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def export_model(model_path=MODEL_PATH, weight_path=MODEL_WEIGHT_PATH,
+                 output_path=MODEL_RUNTIME_PATH, source=None):
+    """
+        Convert a sequential keras model of Dense layers to a NumPy archive
+        Input:
+            model_path: keras model (.h5), read for the architecture
+            weight_path: keras weights (.hdf5), loaded over the model like load_weights
+            source: (string) hash of the keras files, see source_hash
+        Output:
+            (string) output_path
+    """
+    import h5py
+
+    with h5py.File(model_path, 'r') as f:
+        model_config = json.loads(_decode(f.attrs['model_config']))
+    if model_config['class_name'] != 'Sequential':
+        raise ValueError('only Sequential models can be exported, got {}'.format(model_config['class_name']))
+
+    arrays = {}
+    activations = []
+    with h5py.File(weight_path, 'r') as f:
+        weights = f['model_weights'] if 'model_weights' in f else f
+        for i, layer in enumerate(_layer_configs(model_config)):
+            config = layer['config']
+            if layer['class_name'] == 'Dropout':
+                # no-op at inference time
+                continue
+            if layer['class_name'] != 'Dense' or config['activation'] not in ACTIVATIONS:
+                raise ValueError('cannot export layer {} ({}, {})'.format(
+                    config['name'], layer['class_name'], config.get('activation')))
+            group = weights[config['name']]
+            names = [_decode(n) for n in group.attrs['weight_names']]
+            values = {n.split('/')[-1].split(':')[0]: group[n][()] for n in names}
+            n = len(activations)
+            arrays['kernel_{}'.format(n)] = values['kernel'].astype(np.float32)
+            arrays['bias_{}'.format(n)] = (values['bias'] if config.get('use_bias', True)
+                                           else np.zeros(values['kernel'].shape[1])).astype(np.float32)
+            activations.append(config['activation'])
+
+    tmp_path = output_path + '.tmp.npz'
+    np.savez(tmp_path, activations=np.array(activations), source=np.array(source or ''), **arrays)
+    os.replace(tmp_path, output_path)
+    print("Complete: exported {} layers to {}.".format(len(activations), output_path))
+    return output_path
+
+
+class DenseModel:
+    """
+        Forward pass of a stack of Dense layers, with the predict() signature of a keras model
+
+        layers: (list) of (kernel, bias, activation name)
+        source: (string) hash of the keras files the weights come from
+    """
+
+    def __init__(self, layers, source=''):
+        self.layers = [(kernel, bias, ACTIVATIONS[activation]) for kernel, bias, activation in layers]
+        self.source = source
+
+    @classmethod
+    def load(cls, path=MODEL_RUNTIME_PATH):
+        with np.load(path) as archive:
+            activations = list(archive['activations'])
+            layers = [(archive['kernel_{}'.format(i)], archive['bias_{}'.format(i)], str(activation))
+                      for i, activation in enumerate(activations)]
+            return cls(layers, str(archive['source']))
+
+    def predict(self, x, batch_size=None, **kwargs):
+        """
+            Return: (numpy array) float32 outputs of shape (n, units of the last layer)
+        """
+        x = np.asarray(x, dtype=np.float32)
+        # batches bound the size of the hidden activations, 256 floats per row
+        batch_size = batch_size or 4096
+        out = np.empty((len(x), self.layers[-1][0].shape[1]), dtype=np.float32)
+        for start in range(0, len(x), batch_size):
+            h = x[start:start + batch_size]
+            for kernel, bias, activation in self.layers:
+                h = h @ kernel
+                h += bias
+                h = activation(h)
+            out[start:start + batch_size] = h
+        return out
+
+
+class KerasModel:
+    """
+        Keras model with the predict() signature of DenseModel
+
+        The legacy .h5 model declares a (None, None, n) input; Keras 2 took
+        (n_rows, n) inputs for it, Keras 3 needs the middle axis.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    @classmethod
+    def load(cls, model_path=MODEL_PATH, weight_path=MODEL_WEIGHT_PATH):
+        import tensorflow as tf
+        model = tf.keras.models.load_model(model_path, compile=False)
+        model.load_weights(weight_path)
+        return cls(model)
+
+    def predict(self, x, batch_size=None, **kwargs):
+        """
+            Return: (numpy array) float32 outputs of shape (n, units of the last layer)
+        """
+        x = np.asarray(x, dtype=np.float32)
+        if len(self.model.input_shape) == 3:
+            x = x[:, None, :]
+        return self.model.predict(x, batch_size=batch_size, verbose=0).reshape(len(x), -1)
+
+
+def check(model_path, weight_path, runtime_path, n, seed=0):
+    """
+        Compare the NumPy runtime with keras on n random inputs in [0, 1)
+        Return: (float) max relative difference, AssertionError if they do not match
+    """
+    model = DenseModel.load(runtime_path)
+    x = np.random.default_rng(seed).random((n, model.layers[0][0].shape[0]), dtype=np.float32)
+    expected = KerasModel.load(model_path, weight_path).predict(x)
+    actual = model.predict(x)
+    error = np.abs(actual - expected) / np.maximum(np.abs(expected), 1)
+    assert np.allclose(actual, expected, rtol=1e-4, atol=1e-2), \
+        'runtime does not match keras, max relative difference {:.2e}'.format(error.max())
+    return error.max()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export the keras price model to the NumPy runtime.')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--weights', default=MODEL_WEIGHT_PATH)
+    parser.add_argument('--output', default=MODEL_RUNTIME_PATH)
+    parser.add_argument('--check', type=int, default=0, metavar='N',
+                        help='compare with keras on N random inputs, needs tensorflow')
+    args = parser.parse_args(argv)
+
+    from .registry import _file_hash
+    source = source_hash([_file_hash(args.model), _file_hash(args.weights)])
+    export_model(args.model, args.weights, args.output, source)
+    if args.check:
+        error = check(args.model, args.weights, args.output, args.check)
+        print("Max relative difference with keras: {:.2e}.".format(error))
+
+
+if __name__ == '__main__':
+    main()
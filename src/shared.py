@@ -0,0 +1,162 @@
+"""
+    Catalogue shared by all app processes
+
+    The scored snapshot is published once into shared memory (/dev/shm when
+    available) and every process attaches to it read-only: numeric and
+    category columns are wrapped around the memory-mapped files without a
+    copy, string columns stay dictionary encoded and are only decoded for
+    the rows being displayed. A new worker process therefore does not cost
+    another copy of the catalogue columns. The indexes each process builds
+    over them (query engine range orders and rankers, comparables KD-tree)
+    are not shared and still take O(n) memory per process.
+"""
+import os
+import glob
+import fcntl
+import shutil
+import threading
+from contextlib import contextmanager
+import pandas as pd
+
+from .constants import DATA_DIR
+from .snapshot import META_FILE, DictionaryColumn, decode_column, read_meta
+
+SHM_ROOT = '/dev/shm'
+SHARED_DIR = os.path.join(SHM_ROOT, 'diamonds') if os.path.isdir(SHM_ROOT) \
+    else os.path.join(DATA_DIR, 'shared')
+LOCK_FILE = '.lock'
+# one file per process attaching to a published snapshot, see attach_catalogue
+LEASE_DIR = '.leases'
+
+
+@contextmanager
+def _locked(shared_dir):
+    """Serialize publishing, attaching and pruning between processes."""
+    os.makedirs(shared_dir, exist_ok=True)
+    with open(os.path.join(shared_dir, LOCK_FILE), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _leased(shared_dir, name):
+    """Return True if a live process is attaching to the published snapshot name."""
+    leased = False
+    for lease in glob.glob(os.path.join(shared_dir, LEASE_DIR, name + '.*')):
+        if _pid_alive(int(lease.rsplit('.', 2)[-2])):
+            leased = True
+        else:
+            # left over by a process that died while attaching
+            os.remove(lease)
+    return leased
+
+
+def _stamp(path):
+    # scored_<stamp>.snap or scored_<stamp>_<shape>.snap, see src.refresh
+    parts = os.path.basename(path).split('_')
+    return parts[1].split('.')[0] if len(parts) > 1 else parts[0]
+
+
+def _publish(snapshot_path, shared_dir):
+    """Copy the snapshot into shared_dir unless it is there already; caller holds the lock."""
+    path = os.path.join(shared_dir, os.path.basename(snapshot_path))
+    if not os.path.exists(os.path.join(path, META_FILE)):
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        shutil.copytree(snapshot_path, tmp_path)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+    return path
+
+
+def _prune(shared_dir, keep):
+    """Remove the snapshots of all but the last `keep` refreshes, except those being attached."""
+    published = [p for p in glob.glob(os.path.join(shared_dir, '*')) if not p.endswith('.tmp')]
+    old_stamps = sorted({_stamp(p) for p in published})[:-keep]
+    for old in published:
+        if _stamp(old) in old_stamps and not _leased(shared_dir, os.path.basename(old)):
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def publish_catalogue(snapshot_path, shared_dir=SHARED_DIR, keep=2):
+    """
+        Copy a snapshot into shared memory, once; later calls return the published copy
+        keep: (int) number of refreshes whose published snapshots are kept, processes
+              still mapping an older one keep their mapping after it is removed
+        Return: (string) path of the published snapshot
+    """
+    with _locked(shared_dir):
+        path = _publish(snapshot_path, shared_dir)
+        _prune(shared_dir, keep)
+    return path
+
+
+class Catalogue:
+    """
+        Read-only view on a published snapshot
+
+        frame: pandas dataframe of the numeric and category columns, backed
+               by the memory-mapped files
+        strings: (dict) column name -> DictionaryColumn
+    """
+
+    def __init__(self, path, columns=None):
+        meta, columns = read_meta(path, columns)
+        self.path = path
+        self.strings = {}
+        data = {}
+        for name in columns:
+            col_meta = meta['columns'][name]
+            if col_meta['kind'] == 'dictionary':
+                self.strings[name] = DictionaryColumn.load(path, name)
+            else:
+                data[name] = decode_column(path, name, col_meta, mmap=True)
+        # copy=False keeps one block per column instead of consolidating into a copy
+        self.frame = pd.DataFrame(data, copy=False)
+
+    def __len__(self):
+        return len(self.frame)
+
+    def take(self, rows):
+        """
+            Return: pandas dataframe of the given row positions, strings decoded
+        """
+        df = self.frame.iloc[rows].copy()
+        for name, column in self.strings.items():
+            df[name] = column.take(rows)
+        return df
+
+
+def attach_catalogue(snapshot_path, columns=None, shared_dir=SHARED_DIR, keep=2):
+    """
+        Publish the snapshot if needed and attach to the shared copy
+
+        A lease file marks the copy as being attached until all of its files
+        are mapped, so a concurrent publish of a newer snapshot does not prune
+        it in between; once mapped, removing the files no longer matters.
+    """
+    lease = None
+    try:
+        with _locked(shared_dir):
+            path = _publish(snapshot_path, shared_dir)
+            os.makedirs(os.path.join(shared_dir, LEASE_DIR), exist_ok=True)
+            lease = os.path.join(shared_dir, LEASE_DIR, '{}.{}.{}'.format(
+                os.path.basename(path), os.getpid(), threading.get_ident()))
+            open(lease, 'w').close()
+            _prune(shared_dir, keep)
+        return Catalogue(path, columns)
+    finally:
+        if lease is not None and os.path.exists(lease):
+            os.remove(lease)
@@ -0,0 +1,270 @@
+"""
+    Columnar on-disk snapshot of the diamonds catalogue
+
+    A snapshot is a directory with one .npy file per column and a meta.json
+    describing how to rebuild each column:
+        - categoricals (color, clarity, ...) are stored as int8 codes in
+          their own categories and come back as the same pandas
+          categoricals, so graded columns keep the fixed codes of
+          src.categories and raw labels are kept as they are
+        - integer columns are downcast to int32, float columns stay
+          float64 so model inputs are unchanged
+        - strings are dictionary encoded: int32 codes into the distinct
+          values, kept as one utf-8 blob plus offsets (see DictionaryColumn)
+    Every file is memory-mapped on read, so loading only touches the columns
+    asked for and processes reading the same snapshot share its pages.
+"""
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+SNAPSHOT_EXT = '.snap'
+META_FILE = 'meta.json'
+# columns the app and the model read, everything else is dropped on write
+SNAPSHOT_COLS = ['id', 'price', 'carat', 'color', 'clarity', 'cut', 'culet', 'polish',
+                 'symmetry', 'fluorescence', 'depth', 'table', 'lxwRatio', 'sellingIndex',
+                 'measurements', 'hasVisualization', 'visualizationImageUrl']
+CATEGORY_COLS = ['color', 'clarity', 'cut', 'culet', 'polish', 'symmetry', 'fluorescence']
+
+
+def _encode(series, name):
+    """
+        Return: (dict) column meta, (dict) file suffix -> numpy array
+    """
+    if name in CATEGORY_COLS or isinstance(series.dtype, pd.CategoricalDtype):
+        cat = series.astype('category').cat
+        codes = cat.codes.values.astype(np.int8 if len(cat.categories) < 128 else np.int32)
+        return {'kind': 'category', 'categories': cat.categories.tolist()}, {'': codes}
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return {'kind': 'numeric'}, {'': series.values.astype(bool)}
+    if pd.api.types.is_integer_dtype(series.dtype):
+        # int32 at least, so arithmetic on prices can't overflow
+        values = pd.to_numeric(series, downcast='integer').values
+        return {'kind': 'numeric'}, {'': values.astype(np.promote_types(values.dtype, np.int32))}
+    if pd.api.types.is_float_dtype(series.dtype):
+        return {'kind': 'numeric'}, {'': series.values.astype(np.float64)}
+    codes, uniques = pd.factorize(series)
+    encoded = [str(value).encode('utf-8') for value in uniques]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return {'kind': 'dictionary'}, {'': codes.astype(np.int32), '.offsets': offsets, '.blob': blob}
+
+
+def decode_column(path, name, meta, mmap, rows=slice(None)):
+    """
+        Return: (array-like) values of one column, meta is its entry in meta.json
+    """
+    mmap_mode = 'r' if mmap else None
+    values = np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)[rows]
+    if meta['kind'] == 'category':
+        return pd.Categorical.from_codes(values, categories=meta['categories'])
+    if meta['kind'] == 'dictionary':
+        return DictionaryColumn.load(path, name, mmap).decode(values)
+    return values
+
+
+class DictionaryColumn:
+    """
+        Dictionary encoded string column, decoded only for the rows asked for
+
+        codes: (numpy array of int32) one code per row, -1 for missing
+        offsets, blob: the distinct values, value i is blob[offsets[i]:offsets[i + 1]]
+    """
+
+    def __init__(self, codes, offsets, blob):
+        self.codes = codes
+        self.offsets = offsets
+        self.blob = blob
+
+    @classmethod
+    def load(cls, path, name, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        arrays = [np.load(os.path.join(path, name + suffix + '.npy'), mmap_mode=mmap_mode)
+                  for suffix in ['', '.offsets', '.blob']]
+        return cls(*arrays)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def decode(self, codes):
+        """
+            Return: (numpy array of object) the strings for the given codes
+        """
+        codes = np.asarray(codes)
+        uniques, inverse = np.unique(codes, return_inverse=True)
+        values = np.empty(len(uniques), dtype=object)
+        for i, code in enumerate(uniques):
+            if code >= 0:
+                start, stop = self.offsets[code], self.offsets[code + 1]
+                values[i] = self.blob[start:stop].tobytes().decode('utf-8')
+        return values[inverse.reshape(-1)]
+
+    def take(self, rows):
+        return self.decode(self.codes[rows])
+
+
+def read_meta(path, columns):
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+    if columns is None:
+        columns = list(meta['columns'])
+    missing = set(columns) - set(meta['columns'])
+    if missing:
+        raise KeyError('Columns not in snapshot {}: {}'.format(path, sorted(missing)))
+    return meta, columns
+
+
+def _save_column(series, name, path):
+    col_meta, arrays = _encode(series, name)
+    for suffix, values in arrays.items():
+        np.save(os.path.join(path, name + suffix + '.npy'), values)
+    return col_meta
+
+
+def _write_columns(df, path, columns):
+    os.makedirs(path)
+    meta = {'n_rows': len(df), 'columns': {}}
+    for name in columns:
+        if name in df.columns:
+            meta['columns'][name] = _save_column(df[name], name, path)
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+
+def _fresh_dir(path):
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    return path
+
+
+def _move_into_place(tmp_path, path):
+    _fresh_dir(path)
+    os.replace(tmp_path, path)
+
+
+def write_snapshot(df, path, columns=SNAPSHOT_COLS, verbose=True):
+    """
+        Write the given columns of df as a snapshot directory at path
+        The directory is built next to path and renamed into place, so
+        readers never see a half written snapshot.
+    """
+    tmp_path = _fresh_dir(path + '.tmp')
+    _write_columns(df, tmp_path, columns)
+    _move_into_place(tmp_path, path)
+    if verbose:
+        print("Complete: write snapshot to {}.".format(path))
+
+
+def read_snapshot(path, columns=None, mmap=True):
+    """
+        Input:
+            path: snapshot directory
+            columns: (list) column projection, None for all stored columns
+            mmap: (bool) memory-map the column files instead of reading them
+        Output:
+            pandas dataframe, its numeric and category columns are views of the
+            read-only mapped files when mmap is set
+    """
+    meta, columns = read_meta(path, columns)
+    # copy=False, a dict of arrays is copied into the frame by default
+    return pd.DataFrame({name: decode_column(path, name, meta['columns'][name], mmap)
+                         for name in columns}, copy=False)
+
+
+def iter_snapshot(path, chunk_size, columns=None):
+    """
+        Yield the snapshot as dataframes of at most chunk_size rows
+        Only one chunk of every column is decoded at a time.
+    """
+    meta, columns = read_meta(path, columns)
+    for start in range(0, meta['n_rows'], chunk_size):
+        rows = slice(start, start + chunk_size)
+        chunk = pd.DataFrame({name: decode_column(path, name, meta['columns'][name], True, rows)
+                              for name in columns}, copy=False)
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        yield chunk
+
+
+def load_catalogue(path, columns=None):
+    """
+        Read a catalogue file, either a snapshot directory or a csv export
+    """
+    if path.endswith(SNAPSHOT_EXT):
+        return read_snapshot(path, columns)
+    # 'None' is a fluorescence grade, only empty cells are missing
+    return pd.read_csv(path, usecols=columns, keep_default_na=False, na_values=[''])
+
+
+def iter_catalogue(path, chunk_size, columns=None):
+    """
+        Yield a catalogue file as dataframes of at most chunk_size rows
+    """
+    if path.endswith(SNAPSHOT_EXT):
+        yield from iter_snapshot(path, chunk_size, columns)
+    else:
+        yield from pd.read_csv(path, usecols=columns, keep_default_na=False, na_values=[''],
+                               chunksize=chunk_size)
+
+
+class SnapshotWriter:
+    """
+        Build a snapshot from pages appended as they arrive
+
+        Each page is written straight away as a small part snapshot, so the
+        caller only holds one page in memory. close() then merges the parts
+        into the final snapshot one column at a time.
+    """
+
+    def __init__(self, path, columns=SNAPSHOT_COLS):
+        self.path = path
+        self.columns = columns
+        self.parts_dir = _fresh_dir(path + '.parts')
+        os.makedirs(self.parts_dir)
+        self.parts = []
+        self.n_rows = 0
+
+    def append(self, df):
+        part = os.path.join(self.parts_dir, 'part-{:05d}'.format(len(self.parts)))
+        _write_columns(df, part, self.columns)
+        self.parts.append(part)
+        self.n_rows += len(df)
+
+    def discard(self):
+        """Remove the parts written so far, nothing is written at path."""
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+    def _merged_column(self, name):
+        decoded = []
+        for part in self.parts:
+            meta, _ = read_meta(part, [name])
+            decoded.append(pd.Series(decode_column(part, name, meta['columns'][name], False)))
+        if isinstance(decoded[0].dtype, pd.CategoricalDtype):
+            return pd.Series(union_categoricals([s.values for s in decoded]))
+        return pd.concat(decoded, ignore_index=True)
+
+    def close(self, unique='id'):
+        """
+            Merge the parts into the snapshot at path
+            unique: (string) keep only the first row of each value of this column
+        """
+        tmp_path = _fresh_dir(self.path + '.tmp')
+        os.makedirs(tmp_path)
+        columns = read_meta(self.parts[0], None)[1] if self.parts else []
+        keep = None
+        if unique in columns:
+            keep = ~self._merged_column(unique).duplicated().values
+        meta = {'n_rows': int(keep.sum()) if keep is not None else self.n_rows, 'columns': {}}
+        for name in columns:
+            series = self._merged_column(name)
+            if keep is not None:
+                series = series[keep]
+            meta['columns'][name] = _save_column(series, name, tmp_path)
+        with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+            json.dump(meta, f)
+        _move_into_place(tmp_path, self.path)
+        shutil.rmtree(self.parts_dir)
+        print("Complete: write snapshot of {} diamonds to {}.".format(meta['n_rows'], self.path))
@@ -0,0 +1,77 @@
+"""
+    Prediction store for incremental scoring
+
+    Most listings in a daily file are the same as the day before, so their
+    predictions are kept on disk keyed by diamond id plus a hash of the
+    feature columns, and only new or changed rows are sent to the model.
+"""
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from .inference import FEATURE_COLS
+
+
+def feature_hash(df):
+    """
+        Return: (numpy array of uint64) one hash per row over FEATURE_COLS
+    """
+    return pd.util.hash_pandas_object(df[FEATURE_COLS], index=False).values
+
+
+class PredictionStore:
+    """
+        Predictions keyed by (id, feature hash), tagged with the model version
+
+        The whole store is dropped when the model version changes, since
+        none of the cached predictions are valid for the new model.
+    """
+    COLUMNS = ['id', 'feature_hash', 'predicted_price']
+
+    def __init__(self, path, model_version):
+        self.path = path
+        self.model_version = model_version
+        self.table = pd.DataFrame({
+            'id': pd.Series(dtype=object),
+            'feature_hash': pd.Series(dtype='uint64'),
+            'predicted_price': pd.Series(dtype='float32'),
+        })
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+            if saved['model_version'] == model_version:
+                self.table = saved['predictions']
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'model_version': self.model_version,
+                         'predictions': self.table}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def score(self, df, predict_fn):
+        """
+            Input:
+                df: pandas dataframe with 'id' and FEATURE_COLS
+                predict_fn: called only on the rows missing from the store
+            Output:
+                (numpy array) predictions aligned with df rows
+        """
+        keys = pd.DataFrame({'id': df['id'].values, 'feature_hash': feature_hash(df)})
+        cached = keys.merge(self.table, on=['id', 'feature_hash'], how='left')
+        predicted = cached['predicted_price'].values.astype('float32')
+        missing = np.isnan(predicted)
+        if missing.any():
+            predicted[missing] = predict_fn(df[missing])
+            # keep only the latest features of each diamond
+            fresh = keys[missing].assign(predicted_price=predicted[missing])
+            fresh = fresh.drop_duplicates('id', keep='last')
+            self.table = pd.concat([self.table[~self.table['id'].isin(fresh['id'])], fresh],
+                                   ignore_index=True)
+        print("Scored {} new or changed diamonds, reused {} cached predictions.".format(
+            int(missing.sum()), int((~missing).sum())))
+        return predicted
+
+    def prune(self, ids):
+        """Drop diamonds that are no longer listed."""
+        self.table = self.table[self.table['id'].isin(ids)].reset_index(drop=True)